@@ -1,10 +1,17 @@
 from . import output
+from . import lattice
 from . import geometry
 from . import sphere
 from . import polyhedron
+from . import symmetry
+from . import wulff
 from . import cylinder
 from . import periodic_1D_cylinder
 from . import periodic_1D_prism
 from . import periodic_2D_plane
 from . import periodic_3D_supercell
 from . import periodicity
+from . import selection
+from . import atombuffer
+from . import csg
+from . import commensurate
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from nanocut.output import error
+
+__all__ = [ "AtomBuffer" ]
+
+
+# Minimal number of atoms allocated in the buffer files
+MIN_CAPACITY = 1024
+
+
+class AtomBuffer:
+    """Growable storage for atom coordinates and type indices on disk.
+    
+    The atoms are stored in memory mapped files in a temporary directory, so
+    that structures larger than the available memory can be created. Whenever
+    the capacity is exceeded, the files are enlarged by a factor of two.
+    """
+
+    def __init__(self, scratchdir):
+        """Creates an empty buffer.
+        
+        Args:
+            scratchdir: Directory in which the temporary directory containing
+                the buffer files is created.
+        """
+        try:
+            self._dir = tempfile.mkdtemp(prefix="nanocut-", dir=scratchdir)
+        except OSError:
+            error("Can't create scratch directory in '" + scratchdir + "'")
+        self._coords_file = os.path.join(self._dir, "coords.dat")
+        self._idx_file = os.path.join(self._dir, "idx.dat")
+        self._natom = 0
+        self._capacity = 0
+        self._coords = None
+        self._idx = None
+        self._resize(MIN_CAPACITY)
+
+
+    def __len__(self):
+        return self._natom
+
+
+    @property
+    def coords(self):
+        """Memory mapped cartesian coordinates of the stored atoms."""
+        return self._coords[:self._natom]
+
+
+    @property
+    def idx(self):
+        """Memory mapped type indices of the stored atoms."""
+        return self._idx[:self._natom]
+
+
+    def append(self, atoms_coords, atoms_idx):
+        """Appends atoms to the buffer.
+        
+        Args:
+            atoms_coords: Cartesian coordinates of the atoms.
+            atoms_idx: Type indices of the atoms.
+        """
+        natom = self._natom + len(atoms_coords)
+        if natom > self._capacity:
+            self._resize(max(natom, 2 * self._capacity))
+        self._coords[self._natom:natom] = atoms_coords
+        self._idx[self._natom:natom] = atoms_idx
+        self._natom = natom
+
+
+    def flush(self):
+        """Writes any changes to the buffer files."""
+        self._coords.flush()
+        self._idx.flush()
+
+
+    def close(self):
+        """Releases the buffer and removes its files."""
+        self._coords = None
+        self._idx = None
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _resize(self, capacity):
+        """Changes the size of the buffer files.
+        
+        Args:
+            capacity: New number of atoms, which can be stored.
+        """
+        if self._coords is not None:
+            self.flush()
+        # Release old mappings before changing the size of the files.
+        self._coords = None
+        self._idx = None
+        for filename, rowsize in ((self._coords_file, 3 * 8),
+                                  (self._idx_file, 8)):
+            with open(filename, "ab") as fp:
+                fp.truncate(capacity * rowsize)
+        self._coords = np.memmap(self._coords_file, dtype=np.float64,
+                                 mode="r+", shape=(capacity, 3))
+        self._idx = np.memmap(self._idx_file, dtype=np.int64, mode="r+",
+                              shape=(capacity, ))
+        self._capacity = capacity
@@ -1,6 +1,13 @@
 import numpy as np
-from .output import error
+from .output import error, printstatus
+from .common import DEFAULT_CHUNK_SIZE, INTERVAL_TOLERANCE, CULLING_BLOCK_SIZES
+from .common import DISTANCE_TOLERANCE
+from .geometry import iter_row_points
 
+# Classification of blocks of lattice cells with respect to a body
+BLOCK_OUTSIDE = -1
+BLOCK_BOUNDARY = 0
+BLOCK_INSIDE = 1
 class Body:
     """Parent class for all geometrical bodies.
     
@@ -12,6 +19,12 @@ class Body:
     arguments = {
                  "shift_vector": ( "floatarray", (3,), True, True ),    
     }
+    
+    # Whether the atoms inside can be enumerated via row_intervals()
+    exact_enumeration = False
+    
+    # Whether periodic images of atoms must be masked out via mask_unique()
+    periodic = False
         
     
     def __init__(self, geometry, period, **kwargs):
@@ -155,13 +168,275 @@ class Body:
         raise NotImplementedError
     
     
-    def atoms_inside(self):
-        """Decides which atoms are inside the body.
+    def atoms_in_shape(self, atoms):
+        """Decides which atoms are inside the geometrical shape of the body.
         
-        This method must be overriden in the child classes.
+        This method must be overriden in the child classes. Periodic images
+        of atoms are not masked out (see mask_unique()).
+        
+        Args:
+            atoms: Cartesian coordinates of the atoms.
+        
+        Returns:
+            Logical array with True for all atoms inside the shape.
+        """
+        raise NotImplementedError
+
+
+    def atoms_in_shape_bounded(self, atoms):
+        """Decides which atoms are inside the shape, testing only atoms in the
+        containing cuboid.
+        
+        Args:
+            atoms: Cartesian coordinates of the atoms.
+            
+        Returns:
+            Logical array with True for all atoms inside the shape.
+        """
+        cuboid = self.containing_cuboid()
+        incuboid = np.flatnonzero(np.all(np.logical_and(
+            atoms >= cuboid[0] - DISTANCE_TOLERANCE,
+            atoms <= cuboid[1] + DISTANCE_TOLERANCE), axis=1))
+        inside = np.zeros((len(atoms), ), dtype=bool)
+        inside[incuboid] = self.atoms_in_shape(atoms[incuboid])
+        return inside
+
+
+    def mask_unique(self, atoms, mask, seen=None):
+        """Masks out atoms being periodic images of other atoms in the body.
+        
+        Non-periodic bodies have no periodic images, so the mask is returned
+        unchanged. Periodic bodies must override this method.
+        
+        Args:
+            atoms: Cartesian coordinates of the atoms.
+            mask: Logical array with True for the atoms inside the shape.
+            seen: List with the unique boundary atoms found in previous blocks
+                of atoms or None.
+        
+        Returns:
+            Logical array with True for all unique atoms inside the body.
+        """
+        return mask
+
+
+    def classify_blocks(self, corners):
+        """Classifies convex blocks with respect to the body.
+        
+        Child classes should override this method, the default implementation
+        classifies all blocks as boundary blocks.
+        
+        Args:
+            corners: Cartesian coordinates of the corners of the blocks as
+                (-1, 8, 3) shaped array.
+                
+        Returns:
+            Integer array with BLOCK_INSIDE for blocks completely inside,
+            BLOCK_OUTSIDE for blocks completely outside the shape and
+            BLOCK_BOUNDARY otherwise. (In doubt, blocks must be classified as
+            boundary blocks.)
+        """
+        return np.zeros((len(corners), ), dtype=int) + BLOCK_BOUNDARY
+
+
+    def classify_cells(self, geometry, cells, blocksizes=CULLING_BLOCK_SIZES):
+        """Classifies lattice cells by hierarchically refined blocks.
+        
+        The cells are grouped into blocks of the first (coarsest) size, which
+        are classified via classify_blocks(). Cells in boundary blocks are
+        regrouped into blocks of the next size, and so on.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            cells: Lattice indices of the cells as (-1, 3) shaped array.
+            blocksizes: Edge lengths of the blocks on the consecutive levels.
+            
+        Returns:
+            Classification of each cell (see classify_blocks()).
+        """
+        labels = np.zeros((len(cells), ), dtype=int) + BLOCK_BOUNDARY
+        undecided = np.arange(len(cells))
+        for size in blocksizes:
+            if not len(undecided):
+                break
+            blockinds = cells[undecided] // size
+            # Encode block indices as scalars, as unique() is much faster then
+            mininds = blockinds.min(axis=0)
+            shape = blockinds.max(axis=0) - mininds + 1
+            keys = np.ravel_multi_index(tuple((blockinds - mininds).transpose()),
+                                        tuple(shape))
+            keys, inverse = np.unique(keys, return_inverse=True)
+            blockinds = (np.transpose(np.unravel_index(keys, tuple(shape)))
+                         + mininds)
+            blocklabels = self.classify_blocks(
+                geometry.block_corners(blockinds * size, size))
+            labels[undecided] = blocklabels[inverse]
+            undecided = undecided[labels[undecided] == BLOCK_BOUNDARY]
+        return labels
+
+
+    def atoms_in_shape_culled(self, geometry, atoms, cells):
+        """Decides which atoms are inside the shape using block culling.
+        
+        Only atoms in cells classified as boundary cells by classify_cells()
+        are tested individually.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            atoms: Cartesian coordinates of the atoms, as created by
+                Geometry.gen_atoms() for the lattice points of the cells.
+            cells: Lattice indices of the cells as (-1, 3) shaped array.
         
         Returns:
-            Logical array with True for all atoms inside the body.
+            Logical array with True for all atoms inside the shape.
+        """
+        labels = np.repeat(self.classify_cells(geometry, cells),
+                           len(geometry.basis))
+        inside = labels == BLOCK_INSIDE
+        check = np.flatnonzero(labels == BLOCK_BOUNDARY)
+        inside[check] = self.atoms_in_shape(atoms[check])
+        return inside
+
+
+    def row_intervals(self, geometry, rows):
+        """Determines the atoms inside the body along given lattice rows.
+        
+        This method must be overriden in the child classes which set
+        exact_enumeration to True. A row consists of the lattice points
+        (i, j, k) with fixed i and j.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            rows: (i, j) indices of the rows as (-1, 2) shaped array.
+            
+        Returns:
+            Tuple (lower, upper, ambiguous) of (len(rows), len(basis)) shaped
+            arrays. The basis atom of the cell at lattice point (i, j, k) is
+            inside the shape for lower <= k <= upper (empty intervals have
+            lower > upper). Atoms near the ends of the intervals and all atoms
+            of rows flagged as ambiguous are checked explicitly.
         """
         raise NotImplementedError
+
+
+    def iter_atoms_in_shape(self, geometry, chunksize=DEFAULT_CHUNK_SIZE,
+                            slab=None):
+        """Generates the atoms inside the shape without testing a lattice grid.
+        
+        The atoms are enumerated along the lattice rows via the intervals
+        returned by row_intervals(). Only atoms close to the ends of the
+        intervals are tested with atoms_in_shape(). The atoms are delivered in
+        the same order as when the grid of the containing cuboid is filtered.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            chunksize: Maximal number of lattice points per block.
+            slab: Range (start, end) of the first lattice index i, to which the
+                enumeration should be restricted, or None.
+                
+        Yields:
+            Coordinates and type indices of the next block of atoms inside.
+        """
+        rows, kmin_cuboid, kmax_cuboid = geometry.cuboid_row_intervals(
+            self.containing_cuboid())
+        if slab is not None:
+            inslab = np.logical_and(rows[:,0] >= slab[0], rows[:,0] < slab[1])
+            rows = rows[inslab]
+            kmin_cuboid = kmin_cuboid[inslab]
+            kmax_cuboid = kmax_cuboid[inslab]
+        lower, upper, ambiguous = self.row_intervals(geometry, rows)
+        lower = np.maximum(lower, kmin_cuboid[:,np.newaxis])
+        upper = np.minimum(upper, kmax_cuboid[:,np.newaxis])
+        kmin = np.ceil(lower - INTERVAL_TOLERANCE)
+        kmax = np.floor(upper + INTERVAL_TOLERANCE)
+        kmin_sure = np.where(ambiguous, np.inf,
+                             np.ceil(lower + INTERVAL_TOLERANCE))
+        kmax_sure = np.floor(upper - INTERVAL_TOLERANCE)
+        
+        # Enumerate the hull of the intervals of the basis atoms in each row
+        rowmin = kmin.min(axis=1)
+        rowmax = kmax.max(axis=1)
+        nonempty = np.flatnonzero(rowmin <= rowmax)
+        nbasis = len(geometry.basis)
+        npoint = int(np.sum(rowmax[nonempty] - rowmin[nonempty] + 1))
+        printstatus("Number of enumerated lattice points: {:d}".format(npoint),
+                    indentlevel=1)
+        for irow, nmo in iter_row_points(
+                rows[nonempty], rowmin[nonempty].astype(int),
+                rowmax[nonempty].astype(int), chunksize):
+            atoms_coords, atoms_idx = geometry.gen_atoms(
+                np.dot(nmo, geometry.latvecs))
+            atoms_row = np.repeat(nonempty[irow], nbasis)
+            atoms_k = np.repeat(nmo[:,2], nbasis)
+            possible = np.logical_and(
+                atoms_k >= kmin[atoms_row, atoms_idx],
+                atoms_k <= kmax[atoms_row, atoms_idx])
+            inside = np.logical_and(
+                atoms_k >= kmin_sure[atoms_row, atoms_idx],
+                atoms_k <= kmax_sure[atoms_row, atoms_idx])
+            check = np.flatnonzero(np.logical_and(possible,
+                                                  np.logical_not(inside)))
+            inside[check] = self.atoms_in_shape(atoms_coords[check])
+            yield atoms_coords[inside], atoms_idx[inside]
+
+
+def quadratic_row_intervals(qa, qb, qc, cscale, side=1.0):
+    """Solves the condition qa * k**2 + qb * k + qc <= 0 for lattice rows.
     
+    Args:
+        qa: Quadratic coefficient (same for all rows, zero for linear
+            conditions).
+        qb: Linear coefficient for each row (and basis atom).
+        qc: Constant coefficient for each row (and basis atom).
+        cscale: Magnitude of the terms contributing to qc, used to detect rows
+            where the solution is numerically ambiguous.
+        side: If qa is negative, the solution consists of two rays. Only the
+            one extending towards this direction (+1.0 or -1.0) is returned.
+            
+    Returns:
+        Lower and upper ends of the solution intervals and the ambiguity flags
+        (see Body.row_intervals()).
+    """
+    qb, qc, cscale = np.broadcast_arrays(qb, qc, cscale)
+    lower = np.empty(qc.shape, dtype=float)
+    upper = np.empty(qc.shape, dtype=float)
+    if qa == 0.0:
+        ambiguous = np.abs(qc) <= INTERVAL_TOLERANCE * cscale
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = -qc / qb
+        lower.fill(-np.inf)
+        upper.fill(np.inf)
+        upper[qb > 0.0] = bound[qb > 0.0]
+        lower[qb < 0.0] = bound[qb < 0.0]
+        outside = np.logical_and(qb == 0.0, qc > 0.0)
+        lower[outside] = np.inf
+        upper[outside] = -np.inf
+    else:
+        disc = qb**2 - 4.0 * qa * qc
+        dscale = qb**2 + 4.0 * abs(qa) * cscale
+        ambiguous = np.abs(disc) <= INTERVAL_TOLERANCE * dscale
+        sqrtdisc = np.sqrt(np.maximum(disc, 0.0))
+        root1 = (-qb - sqrtdisc) / (2.0 * qa)
+        root2 = (-qb + sqrtdisc) / (2.0 * qa)
+        rootmin = np.minimum(root1, root2)
+        rootmax = np.maximum(root1, root2)
+        if qa > 0.0:
+            lower[:] = np.where(disc >= 0.0, rootmin, np.inf)
+            upper[:] = np.where(disc >= 0.0, rootmax, -np.inf)
+            # Rows nearly touching the surface: take a wider interval
+            halfwidth = (np.sqrt(np.maximum(disc, 0.0)
+                                 + INTERVAL_TOLERANCE * dscale)
+                         / (2.0 * qa))
+            vertex = -qb / (2.0 * qa)
+            lower[ambiguous] = (vertex - halfwidth)[ambiguous]
+            upper[ambiguous] = (vertex + halfwidth)[ambiguous]
+        else:
+            if side > 0.0:
+                lower[:] = np.where(disc > 0.0, rootmax, -np.inf)
+                upper.fill(np.inf)
+            else:
+                lower.fill(-np.inf)
+                upper[:] = np.where(disc > 0.0, rootmin, np.inf)
+            lower[ambiguous] = -np.inf
+            upper[ambiguous] = np.inf
+    return lower, upper, ambiguous
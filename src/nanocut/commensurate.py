@@ -0,0 +1,358 @@
+import numpy as np
+from nanocut.common import EPSILON, SUPERCELL_BATCH_SIZE, SYMMETRY_TOLERANCE
+from nanocut.output import error
+
+__all__ = [ "inplane_cell", "lattice_vectors", "rotation_order",
+            "search_commensurate_cells" ]
+
+
+# Sine of 60 degrees, the minimal angle between reduced 2D basis vectors
+SIN60 = np.sqrt(3.0) / 2.0
+
+# Supercells whose deformation gradients (or strains and twist angles) differ
+# by less than this are considered to be equivalent
+DEFORMATION_TOLERANCE = 1e-6
+
+# Number of length shells in the index of the lattice vectors when combining
+# them to supercells
+NLENGTH_SHELL = 64
+
+
+def inplane_cell(period):
+    """Returns the cell of a 2D periodicity in its plane.
+    
+    Args:
+        period: Periodicity object with 2D periodicity.
+    
+    Returns:
+        Axis vectors as (2, 2) array in the coordinate system of the rotated
+        structure (see Periodicity.rotate_coordsys()).
+    """
+    if period.period_type != "2D":
+        error("Commensurate cells can only be searched for 2D periodicity")
+    axis, dummy = period.rotate_coordsys(np.empty((0, 3), dtype=float))
+    return axis[:,0:2]
+
+
+def lattice_vectors(cell, maxlength):
+    """Returns all vectors of a 2D lattice up to a given length.
+    
+    Args:
+        cell: Cell vectors as (2, 2) array.
+        maxlength: Maximal length of the vectors.
+    
+    Returns:
+        Integer coefficients and cartesian coordinates of the non-zero vectors,
+        sorted by their length.
+    """
+    # Bounds of the coefficients from the lengths of the reciprocal vectors
+    bounds = np.floor(maxlength * np.linalg.norm(np.linalg.inv(cell), axis=0))
+    bounds = bounds.astype(int)
+    coeffs = np.mgrid[-bounds[0]:bounds[0] + 1, -bounds[1]:bounds[1] + 1]
+    coeffs = coeffs.reshape(2, -1).transpose()
+    vectors = np.dot(coeffs, cell)
+    lengths = np.linalg.norm(vectors, axis=1)
+    keep = np.flatnonzero(np.logical_and(lengths > 0.0, lengths <= maxlength))
+    order = keep[np.argsort(lengths[keep], kind="stable")]
+    return coeffs[order], vectors[order]
+
+
+def search_commensurate_cells(cell1, cell2, maxatoms, natoms=(1, 1),
+                              maxstrain=0.01, twist=(0.0, 0.0)):
+    """Searches supercells of two 2D lattices being commensurate.
+    
+    Lattice vectors of both lattices are matched via an index over their
+    lengths: only vectors with lengths compatible with the strain tolerance
+    are paired. The supercells are then built from two matched pairs, the
+    first one with the shorter vector and the second one with a length in the
+    range allowed by the maximal area (as the supercell vectors of the first
+    lattice form a reduced basis). The longer supercell vector may be at most
+    twice as long as the longest possible shorter one, which excludes long and
+    thin supercells. Layer 2 is rotated by the twist angle and strained to fit
+    onto layer 1.
+    
+    Args:
+        cell1: Cell vectors of the first lattice as (2, 2) array.
+        cell2: Cell vectors of the second lattice as (2, 2) array.
+        maxatoms: Maximal number of atoms in the supercells.
+        natoms: Number of atoms in the cells of the two lattices.
+        maxstrain: Maximal relative strain of the second lattice.
+        twist: Range (min, max) of the twist angle of the second lattice in
+            degrees.
+    
+    Returns:
+        Dictionary with the arrays "axis1" and "axis2" (integer coefficients
+        of the supercell vectors with respect to the cells, shape (-1, 2, 2)),
+        "ncell1" and "ncell2" (number of cells of both lattices in the
+        supercell), "natoms" (number of atoms in the supercell), "strain"
+        (largest relative deviation of the principal stretches from one) and
+        "twist" (twist angle in degrees). Only the smallest supercell of each
+        coincidence lattice is returned. Supercells with twist angles
+        differing by a rotation mapping one of the lattices onto itself are
+        equivalent, only the one with the smallest twist angle is returned.
+        The supercells are sorted by the number of atoms and the strain.
+    """
+    cell1 = np.array(cell1, dtype=float)
+    cell2 = np.array(cell2, dtype=float)
+    area1 = abs(np.linalg.det(cell1))
+    area2 = abs(np.linalg.det(cell2))
+    twistmin, twistmax = np.radians(twist)
+    if twistmax < twistmin:
+        error("Invalid twist angle range")
+    maxarea = maxatoms / (natoms[0] / area1 + natoms[1] / area2)
+
+    # Vectors of a reduced basis enclose an angle between 60 and 120 degrees,
+    # so the shorter one can't be longer than maxlength1.
+    maxlength1 = np.sqrt(maxarea / SIN60)
+    second = _matching_vectors(cell1, cell2, 2.0 * maxlength1, maxstrain,
+                               twistmin, twistmax)
+    nfirst = np.searchsorted(second["lengths"], maxlength1, "right")
+    if not nfirst:
+        return _empty_result()
+    first = { key: value[:nfirst] for key, value in second.items() }
+
+    # Index of the second vectors: their pairs are sorted by length shells
+    # and by direction within each shell (with each shell repeated, shifted by
+    # one turn, to handle the periodicity of the directions).
+    shells = np.minimum(
+        (second["lengths"] * (NLENGTH_SHELL / (2.0 * maxlength1))).astype(int),
+        NLENGTH_SHELL - 1)
+    directions = np.mod(np.arctan2(second["vecs1"][:,1],
+                                   second["vecs1"][:,0]), 2.0 * np.pi)
+    keys = np.concatenate(( 4.0 * np.pi * shells + directions,
+                            4.0 * np.pi * shells + directions + 2.0 * np.pi ))
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    order = np.mod(order, len(directions))
+
+    # The second vector of a reduced right handed basis is not shorter than
+    # the first one and points in a direction between 60 and 120 degrees
+    # from it. Search in all shells which may contain such vectors.
+    firstdirs = directions[:nfirst]
+    shellmax = maxarea / (SIN60 * first["lengths"])
+    ifirst, queryshells = _expand_ranges(
+        shells[:nfirst], np.searchsorted(np.arange(1, NLENGTH_SHELL + 1)
+                                         * (2.0 * maxlength1 / NLENGTH_SHELL),
+                                         shellmax, "left") + 1)
+    queryshells = np.minimum(queryshells, NLENGTH_SHELL - 1)
+    offsets = 4.0 * np.pi * queryshells + firstdirs[ifirst]
+    lower = np.searchsorted(keys, offsets + np.pi / 3.0 - EPSILON, "left")
+    upper = np.searchsorted(keys, offsets + 2.0 * np.pi / 3.0 + EPSILON,
+                            "right")
+    counts = upper - lower
+    ends = np.cumsum(counts)
+    results = []
+    chunkstart = 0
+    while chunkstart < len(counts):
+        chunkend = np.searchsorted(ends, ends[chunkstart] - counts[chunkstart]
+                                   + SUPERCELL_BATCH_SIZE, "right")
+        chunkend = max(chunkend, chunkstart + 1)
+        iquery, jj = _expand_ranges(lower[chunkstart:chunkend],
+                                    upper[chunkstart:chunkend])
+        results.append(_combine_pairs(first, second,
+                                      ifirst[iquery + chunkstart], order[jj],
+                                      area1, area2, maxarea, maxstrain,
+                                      twistmin, twistmax))
+        chunkstart = chunkend
+    result = { key: np.concatenate([ res[key] for res in results ])
+               for key in results[0] }
+
+    # Supercells with the same deformation belong to the same coincidence
+    # lattice, keep only the smallest (and most compact) one of them. Then
+    # drop the supercells equivalent by the rotational symmetry of the
+    # lattices: rotating layer 2 by one of its symmetry operations or layer 1
+    # (and therefore the whole structure) by one of its operations changes the
+    # twist angle by a multiple of period.
+    order = np.lexsort(( result["twist"], result["size"], result["ncell2"],
+                         result["ncell1"] ))
+    unique = order[_first_of_groups(result["deform"].reshape(-1, 4)[order])]
+    period = 2.0 * np.pi / np.lcm(rotation_order(cell1), rotation_order(cell2))
+    twists = np.mod(np.radians(result["twist"]), period)
+    twists[twists > period - DEFORMATION_TOLERANCE] -= period
+    keys = np.column_stack(( result["ncell1"], result["ncell2"],
+                             result["strain"], twists ))
+    unique = unique[_first_of_groups(keys[unique])]
+    del result["size"], result["deform"]
+    result = { key: value[unique] for key, value in result.items() }
+    result["natoms"] = (natoms[0] * result["ncell1"]
+                        + natoms[1] * result["ncell2"])
+    order = np.lexsort(( result["strain"], result["natoms"] ))
+    order = order[result["natoms"][order] <= maxatoms]
+    return { key: value[order] for key, value in result.items() }
+
+
+def rotation_order(cell):
+    """Returns the order of the rotational symmetry of a 2D lattice.
+    
+    Args:
+        cell: Cell vectors as (2, 2) array.
+    
+    Returns:
+        6 for hexagonal, 4 for square and 2 for all other lattices.
+    """
+    for order in ( 6, 4 ):
+        angle = 2.0 * np.pi / order
+        rotation = np.array([[ np.cos(angle), np.sin(angle) ],
+                             [ -np.sin(angle), np.cos(angle) ]])
+        coeffs = np.dot(np.dot(cell, rotation), np.linalg.inv(cell))
+        if np.all(np.abs(coeffs - np.round(coeffs)) < SYMMETRY_TOLERANCE):
+            return order
+    return 2
+
+
+def _first_of_groups(keys):
+    """Finds the first occurrences of keys, which are equal within tolerance.
+    
+    Args:
+        keys: Keys as (-1, nkey) array.
+    
+    Returns:
+        Sorted indices of the first occurrence of each distinct key.
+    """
+    dummy, first = np.unique(np.round(keys / DEFORMATION_TOLERANCE), axis=0,
+                             return_index=True)
+    return np.sort(first)
+
+
+def _matching_vectors(cell1, cell2, maxlength, maxstrain, twistmin, twistmax):
+    """Pairs lattice vectors of two lattices with compatible length and angle.
+    
+    Args:
+        cell1: Cell vectors of the first lattice.
+        cell2: Cell vectors of the second lattice.
+        maxlength: Maximal length of the vectors of the first lattice.
+        maxstrain: Maximal relative strain.
+        twistmin: Minimal twist angle (in radians).
+        twistmax: Maximal twist angle (in radians).
+    
+    Returns:
+        Dictionary with the coefficients ("coeffs1", "coeffs2") and the
+        cartesian coordinates ("vecs1", "vecs2") of the paired vectors, the
+        length of the vector of the first lattice ("lengths") and the rotation
+        angle between the vectors relative to twistmin ("angles"). The pairs
+        are sorted by the lengths.
+    """
+    coeffs1, vecs1 = lattice_vectors(cell1, maxlength)
+    coeffs2, vecs2 = lattice_vectors(cell2, maxlength / (1.0 - maxstrain))
+    lengths1 = np.linalg.norm(vecs1, axis=1)
+    lengths2 = np.linalg.norm(vecs2, axis=1)
+    lower = np.searchsorted(lengths2, lengths1 / (1.0 + maxstrain), "left")
+    upper = np.searchsorted(lengths2, lengths1 / (1.0 - maxstrain), "right")
+    ind1, ind2 = _expand_ranges(lower, upper)
+    angles = (np.arctan2(vecs1[ind1,1], vecs1[ind1,0])
+              - np.arctan2(vecs2[ind2,1], vecs2[ind2,0]))
+    # The rotation of a single vector differs from the rotation of the
+    # supercell by at most about the strain.
+    angletol = 2.0 * maxstrain
+    angles = np.mod(angles - twistmin + angletol, 2.0 * np.pi) - angletol
+    keep = np.flatnonzero(angles <= twistmax - twistmin + angletol)
+    ind1, ind2 = ind1[keep], ind2[keep]
+    return { "coeffs1": coeffs1[ind1], "coeffs2": coeffs2[ind2],
+             "vecs1": vecs1[ind1], "vecs2": vecs2[ind2],
+             "lengths": lengths1[ind1], "angles": angles[keep] }
+
+
+def _combine_pairs(first, second, ii, jj, area1, area2, maxarea, maxstrain,
+                   twistmin, twistmax):
+    """Builds supercells from pairs of matching vectors.
+    
+    Args:
+        first: Pairs of matching vectors for the first supercell vector.
+        second: Pairs of matching vectors for the second supercell vector.
+        ii: Index of the first pair for each supercell.
+        jj: Index of the second pair for each supercell.
+        area1: Area of the cell of the first lattice.
+        area2: Area of the cell of the second lattice.
+        maxarea: Maximal area of the supercells.
+        maxstrain: Maximal relative strain.
+        twistmin: Minimal twist angle (in radians).
+        twistmax: Maximal twist angle (in radians).
+    
+    Returns:
+        Properties of the commensurate supercells found (see
+        search_commensurate_cells()), the deformation gradients ("deform")
+        and the sum of the squared lengths of all supercell vectors ("size").
+    """
+    # Both pairs must be rotated by nearly the same angle and the second vector
+    # must be at least as long as the first one.
+    anglediff = np.abs(first["angles"][ii] - second["angles"][jj])
+    keep = np.flatnonzero(
+        (anglediff <= 4.0 * maxstrain)
+        & (second["lengths"][jj] >= first["lengths"][ii] * (1.0 - EPSILON)))
+    ii, jj = ii[keep], jj[keep]
+    va, vb = first["vecs1"][ii], second["vecs1"][jj]
+    wa, wb = first["vecs2"][ii], second["vecs2"][jj]
+    areas1 = va[:,0] * vb[:,1] - va[:,1] * vb[:,0]
+    areas2 = wa[:,0] * wb[:,1] - wa[:,1] * wb[:,0]
+    # Supercells of lattice 1 must be reduced and right handed
+    proj = np.abs(np.sum(va * vb, axis=1))
+    keep = np.flatnonzero(
+        (areas1 > 0.5 * area1) & (areas1 <= maxarea) & (areas2 > 0.5 * area2)
+        & (proj <= 0.5 * first["lengths"][ii]**2 * (1.0 + EPSILON)))
+    ii, jj = ii[keep], jj[keep]
+    va, vb, wa, wb = va[keep], vb[keep], wa[keep], wb[keep]
+    areas1, areas2 = areas1[keep], areas2[keep]
+
+    # Deformation gradient mapping the supercell of lattice 2 onto the one of
+    # lattice 1 (F = V W^-1 with the supercell vectors as columns)
+    deform = np.empty((len(ii), 2, 2), dtype=float)
+    deform[:,:,0] = (va * wb[:,1:2] - vb * wa[:,1:2]) / areas2[:,np.newaxis]
+    deform[:,:,1] = (vb * wa[:,0:1] - va * wb[:,0:1]) / areas2[:,np.newaxis]
+    rotangles = np.arctan2(deform[:,1,0] - deform[:,0,1],
+                           deform[:,0,0] + deform[:,1,1])
+    # Eigenvalues of the Green-Lagrange strain tensor F^T F - 1 (written to
+    # avoid cancellation for small strains)
+    metric00 = np.sum(deform[:,:,0]**2, axis=1)
+    metric11 = np.sum(deform[:,:,1]**2, axis=1)
+    metric01 = np.sum(deform[:,:,0] * deform[:,:,1], axis=1)
+    mean = (metric00 + metric11) / 2.0 - 1.0
+    disc = np.hypot((metric00 - metric11) / 2.0, metric01)
+    strains = np.maximum(np.abs(np.sqrt(1.0 + mean - disc) - 1.0),
+                         np.abs(np.sqrt(1.0 + mean + disc) - 1.0))
+    rotangles = np.mod(rotangles - twistmin + np.pi, 2.0 * np.pi) - np.pi
+    keep = np.flatnonzero(
+        (strains <= maxstrain) & (rotangles >= -EPSILON)
+        & (rotangles <= twistmax - twistmin + EPSILON))
+    ii, jj = ii[keep], jj[keep]
+    return {
+        "axis1": np.stack(( first["coeffs1"][ii], second["coeffs1"][jj] ),
+                          axis=1),
+        "axis2": np.stack(( first["coeffs2"][ii], second["coeffs2"][jj] ),
+                          axis=1),
+        "ncell1": np.round(areas1[keep] / area1).astype(int),
+        "ncell2": np.round(areas2[keep] / area2).astype(int),
+        "strain": strains[keep],
+        "twist": np.degrees(rotangles[keep] + twistmin),
+        "deform": deform[keep],
+        "size": np.sum(va[keep]**2 + vb[keep]**2 + wa[keep]**2
+                       + wb[keep]**2, axis=1),
+    }
+
+
+def _empty_result():
+    """Returns the result of a search without any supercells found."""
+    return { "axis1": np.empty((0, 2, 2), dtype=int),
+             "axis2": np.empty((0, 2, 2), dtype=int),
+             "ncell1": np.empty((0, ), dtype=int),
+             "ncell2": np.empty((0, ), dtype=int),
+             "natoms": np.empty((0, ), dtype=int),
+             "strain": np.empty((0, ), dtype=float),
+             "twist": np.empty((0, ), dtype=float) }
+
+
+def _expand_ranges(lower, upper):
+    """Expands index ranges into pairs of indices.
+    
+    Args:
+        lower: First index of the range belonging to each item.
+        upper: Index after the last one of the range of each item.
+    
+    Returns:
+        Index of the item and index within its range for each pair.
+    """
+    counts = np.maximum(upper - lower, 0)
+    items = np.repeat(np.arange(len(lower)), counts)
+    starts = np.cumsum(counts) - counts
+    indices = (np.arange(int(np.sum(counts))) - np.repeat(starts, counts)
+               + np.repeat(lower, counts))
+    return items, indices
@@ -11,5 +11,57 @@ RELATIVE_PERIODIC_TOLERANCE = 1e-4
 # Tolerance for considering two atoms being on the same position
 DISTANCE_TOLERANCE = 1e-8
 
+# Atoms whose heights along the surface normal differ by less than this belong
+# to the same atomic layer when searching slab terminations
+LAYER_TOLERANCE = 1e-6
+
 # General numerical tolerance (for comparing real numbers)
 EPSILON = 1e-12
+
+# Default number of lattice points processed at once when the lattice grid is
+# enumerated block by block
+DEFAULT_CHUNK_SIZE = 65536
+
+# Number of atoms folded and rotated at once when transforming the final
+# structure (fixed, so that the result does not depend on other chunk sizes)
+TRANSFORM_CHUNK_SIZE = 65536
+
+# Atoms closer than this to the ends of their lattice row interval (in units of
+# the lattice index) are checked explicitly when enumerating rows
+INTERVAL_TOLERANCE = 1e-6
+
+# Edge lengths (in lattice cells) of the blocks used for hierarchical culling,
+# from the coarsest to the finest level
+CULLING_BLOCK_SIZES = (16, 4, 1)
+
+# Safety margin for classifying blocks as being completely inside or outside of
+# a body
+CULLING_TOLERANCE = 1e-6
+
+# Maximal deviation of the elements of the transformation matrices from the
+# ones of the ideal cubic supercell when searching for supercells
+SUPERCELL_SEARCH_RANGE = 2
+
+# Maximal relative deviation of the number of cells from the requested one when
+# searching for supercells
+SUPERCELL_SIZE_TOLERANCE = 0.1
+
+# Number of transformation matrices evaluated at once when searching supercells
+SUPERCELL_BATCH_SIZE = 65536
+
+# Relative tolerance for deciding whether a point is outside of a face when
+# building convex hulls (relative to the norms of the points involved)
+HULL_TOLERANCE = 1e-14
+
+# Maximal relative displacement of the points before building convex hulls
+# (breaks up coplanar points, must be much larger than HULL_TOLERANCE)
+HULL_JOGGLE = 1e-10
+
+# Before building the convex hull of the dual points of the planes of a
+# polyhedron, the reference point is moved away from planes closer to it than
+# this fraction of the distance of the farthest plane
+HULL_HEIGHT_RATIO = 1e-3
+
+# Maximal displacement of the atoms by an operation considered to be a symmetry
+# of the crystal
+SYMMETRY_TOLERANCE = 1e-5
@@ -0,0 +1,345 @@
+import re
+import numpy as np
+from nanocut.output import error, warning
+
+__all__ = [ "CSGTree" ]
+
+
+# Tokens of a CSG expression: body names (inserted as the first alternative,
+# longest first), operators and parentheses and unknown words
+_TOKEN_PATTERN = r"\s*(?:({})(?=[\s()+&-]|$)|([-+&()])|([^\s()+&-]+))"
+
+
+class CSGTree:
+    """Constructive solid geometry tree combining bodies.
+    
+    The nodes of the tree are unions, differences and intersections of
+    bodies or other nodes. When selecting atoms, each node only evaluates the
+    atoms which are not decided yet by its parent: the second operand of a
+    union only tests atoms outside the first one, the subtracted operand of
+    a difference only tests atoms inside the first one, etc.
+    
+    Attributes:
+        bodies: Distinct bodies appearing in the tree.
+    """
+
+    def __init__(self, root, bodies):
+        """Initializes a CSG tree.
+        
+        Args:
+            root: Root node of the tree.
+            bodies: Bodies referenced by the leaves of the tree (via their
+                position in the list).
+        """
+        # Keep only the bodies actually used, in order of appearance
+        used = []
+        for leaf in root.leaves():
+            if leaf.ibody not in used:
+                used.append(leaf.ibody)
+        for leaf in root.leaves():
+            leaf.ibody = used.index(leaf.ibody)
+        self.root = root
+        self.bodies = [ bodies[ibody] for ibody in used ]
+
+
+    @property
+    def periodic(self):
+        """Whether periodic images of atoms must be masked out."""
+        return any(body.periodic for body in self.bodies)
+
+
+    def containing_cuboids(self):
+        """Returns cuboids containing all atoms, which can be selected.
+        
+        Returns:
+            Array with the minimal and maximal cartesian coordinates of each
+            cuboid, shape (-1, 2, 3).
+        """
+        return np.array([ self.bodies[ibody].containing_cuboid()
+                          for ibody in self.root.bounding_bodies() ])
+
+
+    def enumeration_body(self):
+        """Returns a body containing all atoms, which can be selected.
+        
+        Returns:
+            Index of the body in the bodies attribute or None, if no single body
+            contains all selectable atoms.
+        """
+        bounding = self.root.bounding_bodies()
+        return bounding[0] if len(bounding) == 1 else None
+
+
+    def select(self, atoms, masks=None, inside=None):
+        """Selects the atoms described by the tree.
+        
+        Args:
+            atoms: Cartesian coordinates of the atoms.
+            masks: Logical array of shape (nbody, natom) telling for each body
+                which atoms are inside. If None, the bodies are tested
+                directly, as far as necessary.
+            inside: Index of a body, which is known to contain all atoms, or
+                None.
+        
+        Returns:
+            Logical array with True for all selected atoms.
+        """
+        candidates = np.arange(len(atoms))
+        return self.root.select(self, atoms, candidates, masks, inside)
+
+
+    @classmethod
+    def fromlist(cls, bodies):
+        """Builds a tree from bodies which are added or subtracted in turn.
+        
+        Args:
+            bodies: List of bodies and their additivity flag.
+        
+        Returns:
+            Initialized tree.
+        """
+        root = None
+        for ibody, (body, additive) in enumerate(bodies):
+            if additive:
+                root = (CSGLeaf(ibody) if root is None
+                        else CSGUnion([ root, CSGLeaf(ibody) ]))
+            elif root is not None:
+                root = CSGDifference([ root, CSGLeaf(ibody) ])
+        if root is None:
+            error("No additive bodies specified.")
+        return cls(root, [ body for body, additive in bodies ])
+
+
+    @classmethod
+    def fromexpression(cls, expression, names, bodies):
+        """Builds a tree from an expression.
+        
+        The expression combines body names with the operators "+" (union),
+        "-" (difference) and "&" (intersection). Intersection binds stronger
+        than union and difference, which are evaluated from left to right.
+        Parentheses can be used for grouping. Body names may contain any
+        character allowed in section names: at each position the longest
+        body name is taken, which is followed by whitespace, an operator, a
+        parenthesis or the end of the expression. Bodies not appearing in the
+        expression are dropped with a warning.
+        
+        Args:
+            expression: Expression to parse.
+            names: List of the possible names for each body.
+            bodies: List of the bodies.
+        
+        Returns:
+            Initialized tree.
+        """
+        allnames = sorted(set(name for bodynames in names
+                              for name in bodynames), key=len, reverse=True)
+        pattern = re.compile(_TOKEN_PATTERN.format(
+            "|".join(re.escape(name) for name in allnames) or "(?!)"))
+        tokens = []
+        pos = 0
+        expression = expression.strip()
+        while pos < len(expression):
+            match = pattern.match(expression, pos)
+            if match is None:
+                error("Invalid CSG expression '" + expression + "'")
+            tokens.append(( match.group(2) is not None,
+                            match.group(1) or match.group(2)
+                            or match.group(3) ))
+            pos = match.end()
+        parser = _ExpressionParser(tokens, names)
+        root = parser.parse_expression()
+        if parser.pos != len(tokens):
+            error("Unexpected '" + tokens[parser.pos][1]
+                  + "' in CSG expression")
+        used = set(leaf.ibody for leaf in root.leaves())
+        for ibody, bodynames in enumerate(names):
+            if ibody not in used:
+                warning("Body '" + bodynames[-1] + "' not used in CSG "
+                        "expression, ignored")
+        return cls(root, bodies)
+
+
+class CSGLeaf:
+    """Leaf of a CSG tree, representing a body."""
+
+    def __init__(self, ibody):
+        self.ibody = ibody
+
+
+    def leaves(self):
+        """Returns the leaves of the node."""
+        return [ self ]
+
+
+    def bounding_bodies(self):
+        """Returns bodies, whose union contains all selectable atoms."""
+        return [ self.ibody ]
+
+
+    def select(self, tree, atoms, candidates, masks, inside):
+        """Decides which of the candidate atoms are selected by the node.
+        
+        Args:
+            tree: Tree containing the node.
+            atoms: Cartesian coordinates of all atoms.
+            candidates: Indices of the atoms to consider.
+            masks: Masks of the bodies or None (see CSGTree.select()).
+            inside: Body known to contain all atoms or None.
+        
+        Returns:
+            Logical array with True for the selected candidates.
+        """
+        if masks is not None:
+            return masks[self.ibody][candidates]
+        if self.ibody == inside:
+            return np.ones((len(candidates), ), dtype=bool)
+        return tree.bodies[self.ibody].atoms_in_shape_bounded(
+            atoms[candidates])
+
+
+class CSGNode:
+    """Inner node of a CSG tree, combining its children."""
+
+    def __init__(self, children):
+        self.children = children
+
+
+    def leaves(self):
+        """Returns the leaves of the node."""
+        return [ leaf for child in self.children for leaf in child.leaves() ]
+
+
+class CSGUnion(CSGNode):
+    """Atoms inside any of the children."""
+
+    def bounding_bodies(self):
+        """Returns bodies, whose union contains all selectable atoms."""
+        return [ ibody for child in self.children
+                 for ibody in child.bounding_bodies() ]
+
+
+    def select(self, tree, atoms, candidates, masks, inside):
+        """Decides which of the candidate atoms are selected by the node."""
+        selected = np.zeros((len(candidates), ), dtype=bool)
+        undecided = np.arange(len(candidates))
+        for child in self.children:
+            if not len(undecided):
+                break
+            inchild = child.select(tree, atoms, candidates[undecided], masks,
+                                   inside)
+            selected[undecided[inchild]] = True
+            undecided = undecided[np.logical_not(inchild)]
+        return selected
+
+
+class CSGDifference(CSGNode):
+    """Atoms inside the first child but not inside any of the others."""
+
+    def bounding_bodies(self):
+        """Returns bodies, whose union contains all selectable atoms."""
+        return self.children[0].bounding_bodies()
+
+
+    def select(self, tree, atoms, candidates, masks, inside):
+        """Decides which of the candidate atoms are selected by the node."""
+        selected = self.children[0].select(tree, atoms, candidates, masks,
+                                           inside)
+        for child in self.children[1:]:
+            undecided = np.flatnonzero(selected)
+            if not len(undecided):
+                break
+            selected[undecided] = np.logical_not(child.select(
+                tree, atoms, candidates[undecided], masks, inside))
+        return selected
+
+
+class CSGIntersection(CSGNode):
+    """Atoms inside all children."""
+
+    def bounding_bodies(self):
+        """Returns bodies, whose union contains all selectable atoms."""
+        # Any child would do, take the one with the fewest bodies.
+        return min(( child.bounding_bodies() for child in self.children ),
+                   key=len)
+
+
+    def select(self, tree, atoms, candidates, masks, inside):
+        """Decides which of the candidate atoms are selected by the node."""
+        selected = np.ones((len(candidates), ), dtype=bool)
+        for child in self.children:
+            undecided = np.flatnonzero(selected)
+            if not len(undecided):
+                break
+            selected[undecided] = child.select(tree, atoms,
+                                               candidates[undecided], masks,
+                                               inside)
+        return selected
+
+
+class _ExpressionParser:
+    """Recursive descent parser for CSG expressions."""
+
+    def __init__(self, tokens, names):
+        # Tokens as (isoperator, text) tuples
+        self.tokens = tokens
+        self.names = names
+        self.pos = 0
+
+
+    def peek(self):
+        """Returns the next token, if it is an operator or a parenthesis."""
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0]:
+            return self.tokens[self.pos][1]
+        return None
+
+
+    def parse_expression(self):
+        """expression := term { ("+" | "-") term }"""
+        node = self.parse_term()
+        while self.peek() in ( "+", "-" ):
+            operator = self.tokens[self.pos][1]
+            self.pos += 1
+            operand = self.parse_term()
+            nodeclass = CSGUnion if operator == "+" else CSGDifference
+            if isinstance(node, nodeclass):
+                node.children.append(operand)
+            else:
+                node = nodeclass([ node, operand ])
+        return node
+
+
+    def parse_term(self):
+        """term := factor { "&" factor }"""
+        node = self.parse_factor()
+        while self.peek() == "&":
+            self.pos += 1
+            operand = self.parse_factor()
+            if isinstance(node, CSGIntersection):
+                node.children.append(operand)
+            else:
+                node = CSGIntersection([ node, operand ])
+        return node
+
+
+    def parse_factor(self):
+        """factor := name | "(" expression ")" """
+        if self.pos == len(self.tokens):
+            error("Unexpected end of CSG expression")
+        isoperator, token = self.tokens[self.pos]
+        self.pos += 1
+        if isoperator and token == "(":
+            node = self.parse_expression()
+            if self.peek() != ")":
+                error("Missing ')' in CSG expression")
+            self.pos += 1
+            return node
+        if isoperator:
+            error("Unexpected '" + token + "' in CSG expression")
+        matching = [ ibody for ibody, bodynames in enumerate(self.names)
+                     if token in bodynames ]
+        if not matching:
+            error("Unknown body '" + token + "' in CSG expression")
+        elif len(matching) > 1:
+            error("Ambiguous body name '" + token + "' in CSG expression "
+                  "(use TYPE:NAME)")
+        return CSGLeaf(matching[0])
@@ -1,5 +1,7 @@
 import numpy as np
-from nanocut.body import Body
+from nanocut.body import Body, quadratic_row_intervals
+from nanocut.body import BLOCK_INSIDE, BLOCK_OUTSIDE, BLOCK_BOUNDARY
+from nanocut.common import EPSILON, INTERVAL_TOLERANCE, CULLING_TOLERANCE
 
 class Cylinder(Body):
     """Class for right circular cylinders"""
@@ -13,6 +15,8 @@ class Cylinder(Body):
                  "radius2": ( "float", None, False, False )                 
                 }
     
+    exact_enumeration = True
+    
   
     def __init__(self, geometry, period, **kwargs):
         """Creates a Cylinder instance.
@@ -51,13 +55,14 @@ class Cylinder(Body):
         return np.vstack(( bounds.min(axis=0), bounds.max(axis=0) ))
   
   
-    def atoms_inside(self, atoms, periodicity=None):
-        """Decides which atoms are inside the body (see Body class)."""
+    def atoms_in_shape(self, atoms):
+        """Decides which atoms are inside the shape (see Body class)."""
 
         dirvec0 = self._dir_vector / self._norm
         relpos = atoms - self._point1 - self.shift_vector
         dists = np.sqrt(np.sum(np.cross(relpos, dirvec0)**2, axis=1))
-        heights = np.dot(relpos, dirvec0) / self._norm
+        # Elementwise, as the rounding of np.dot() depends on the array shape
+        heights = np.sum(relpos * dirvec0, axis=1) / self._norm
         # maximal allowed distance at given height
         maxdists = self._radius1 + (self._radius2 - self._radius1) * heights
         atoms_inside = np.logical_and(
@@ -65,4 +70,80 @@ class Cylinder(Body):
                            np.less_equal(heights, 1.0)),
             np.greater_equal(heights, 0.0))
         return atoms_inside
-    
\ No newline at end of file
+
+
+    def classify_blocks(self, corners):
+        """Classifies convex blocks with respect to the body (see Body
+        class)."""
+        dirvec0 = self._dir_vector / self._norm
+        relpos = corners - self._point1 - self.shift_vector
+        dists = np.sqrt(np.sum(np.cross(relpos, dirvec0)**2, axis=2))
+        heights = np.dot(relpos, dirvec0)
+        maxdists = (self._radius1 + (self._radius2 - self._radius1)
+                    * heights / self._norm)
+        # The body is convex: block is inside if all corners are inside.
+        inside = np.all(np.logical_and(
+            np.logical_and(dists <= maxdists - CULLING_TOLERANCE,
+                           heights >= CULLING_TOLERANCE),
+            heights <= self._norm - CULLING_TOLERANCE), axis=1)
+        # Block is outside if it is completely below or above the caps or its
+        # bounding sphere does not reach the widest possible cylinder.
+        outside = np.logical_or(
+            np.all(heights < -CULLING_TOLERANCE, axis=1),
+            np.all(heights > self._norm + CULLING_TOLERANCE, axis=1))
+        center = corners.mean(axis=1)
+        radius = np.sqrt(np.max(np.sum((corners - center[:,np.newaxis,:])**2,
+                                       axis=2), axis=1))
+        centerdists = np.sqrt(np.sum(np.cross(
+            center - self._point1 - self.shift_vector, dirvec0)**2, axis=1))
+        outside = np.logical_or(
+            outside, centerdists - radius
+            > max(self._radius1, self._radius2) + CULLING_TOLERANCE)
+        return np.where(inside, BLOCK_INSIDE,
+                        np.where(outside, BLOCK_OUTSIDE, BLOCK_BOUNDARY))
+
+
+    def row_intervals(self, geometry, rows):
+        """Determines the atoms inside the body along lattice rows (see Body
+        class)."""
+        dirvec0 = self._dir_vector / self._norm
+        kvec = geometry.latvecs[2]
+        ww = (np.dot(rows, geometry.latvecs[0:2])[:,np.newaxis,:]
+              + geometry.basis - self._point1 - self.shift_vector)
+        
+        # Heights are linear along the row: height = h0 + k * h1
+        h0 = np.dot(ww, dirvec0) / self._norm
+        h1 = np.dot(kvec, dirvec0) / self._norm
+        if abs(h1) < EPSILON:
+            lower = np.empty(h0.shape, dtype=float)
+            upper = np.empty(h0.shape, dtype=float)
+            lower.fill(-np.inf)
+            upper.fill(np.inf)
+            outside = np.logical_or(h0 < -INTERVAL_TOLERANCE,
+                                    h0 > 1.0 + INTERVAL_TOLERANCE)
+            lower[outside] = np.inf
+            upper[outside] = -np.inf
+            ambiguous = np.logical_or(np.abs(h0) <= INTERVAL_TOLERANCE,
+                                      np.abs(h0 - 1.0) <= INTERVAL_TOLERANCE)
+        else:
+            bound1 = -h0 / h1
+            bound2 = (1.0 - h0) / h1
+            lower = np.minimum(bound1, bound2)
+            upper = np.maximum(bound1, bound2)
+            ambiguous = np.zeros(h0.shape, dtype=bool)
+            
+        # Condition: distance**2 <= maxdist**2, both being quadratic in k,
+        # with maxdist = m0 + k * m1 non-negative for valid heights.
+        wperp = ww - np.dot(ww, dirvec0)[:,:,np.newaxis] * dirvec0
+        kperp = kvec - np.dot(kvec, dirvec0) * dirvec0
+        m0 = self._radius1 + (self._radius2 - self._radius1) * h0
+        m1 = (self._radius2 - self._radius1) * h1
+        qa = np.dot(kperp, kperp) - m1**2
+        if abs(qa) <= EPSILON * (np.dot(kvec, kvec) + m1**2):
+            qa = 0.0
+        wperpsquare = np.sum(wperp**2, axis=2)
+        qlower, qupper, qambiguous = quadratic_row_intervals(
+            qa, 2.0 * (np.dot(wperp, kperp) - m0 * m1),
+            wperpsquare - m0**2, wperpsquare + m0**2, np.sign(m1))
+        return (np.maximum(lower, qlower), np.minimum(upper, qupper),
+                np.logical_or(ambiguous, qambiguous))
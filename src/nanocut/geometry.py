@@ -1,14 +1,31 @@
 import numpy as np
-from nanocut.common import EPSILON
+from nanocut.common import EPSILON, DISTANCE_TOLERANCE, DEFAULT_CHUNK_SIZE
 from nanocut.output import error, printstatus
+from nanocut.periodicity import reduce_axis, cell_aspect_ratio
+from nanocut.lattice import LatticeTransforms
 
 class Geometry:
     """Class for handling crystal structure, containing unit-cell-vectors,
-    atom coordinates and names of atoms."""
+    atom coordinates and names of atoms.
+    
+    Attributes:
+        input_latvecs: Lattice vectors as specified. Lattice coordinates
+            (e.g. in coord_transform()) always refer to them.
+        latvecs: Lattice vectors used to enumerate the lattice points. They
+            are the reduced input lattice vectors if lattice reduction was
+            requested and the input lattice vectors otherwise.
+        reduction: Integer matrix transforming the input lattice vectors into
+            the enumeration lattice vectors.
+        input_lattice: Transformations (LatticeTransforms) for the input
+            lattice vectors.
+        lattice: Transformations for the enumeration lattice vectors.
+        bravais_lattice: Transformations for the vectors of the Bravais cell.
+    """
 
     def __init__(self, latvecs, basis, basis_names_idx, basis_names,
                  basis_coordsys="lattice", shift=None,
-                 shift_coordsys="lattice", bravais_cell=None):
+                 shift_coordsys="lattice", bravais_cell=None,
+                 reduce_lattice=False):
         """Initializes Geometry object.
         
         Args:
@@ -19,8 +36,19 @@ class Geometry:
             basis_coordsys: Coordinate system for the basis (should be "lattice"
                 or "cartesian").
             bravais_cell: Specifies the Bravais superlattice.
+            reduce_lattice: Whether the lattice points should be enumerated
+                using the reduced lattice vectors.
         """
-        self.latvecs = np.array(latvecs, dtype=float)
+        self.input_latvecs = np.array(latvecs, dtype=float)
+        if reduce_lattice:
+            self.reduction = reduce_axis(np.eye(3, dtype=int),
+                                         self.input_latvecs)
+        else:
+            self.reduction = np.eye(3, dtype=int)
+        self.latvecs = np.dot(self.reduction, self.input_latvecs)
+        self._invreduction = np.linalg.inv(self.reduction)
+        self.input_lattice = LatticeTransforms(self.input_latvecs)
+        self.lattice = LatticeTransforms(self.latvecs)
         self.basis_names_idx = basis_names_idx
         self.basis_names = basis_names
         self.basis_coordsys = basis_coordsys
@@ -34,6 +62,8 @@ class Geometry:
             self.bravais_cell = np.array(bravais_cell)
         else:
             self.bravais_cell = np.eye(3, dtype=float)
+        self.bravais_lattice = LatticeTransforms(
+            np.dot(self.bravais_cell, self.input_latvecs))
 
 
     @classmethod
@@ -85,9 +115,22 @@ class Geometry:
             bravais_cell.shape = (3, 3)
         except ValueError:
             error("Invalid Bravais cell definition")
+            
+        try:
+            reduce_lattice = inidict.getboolean("reduce_lattice",
+                                                fallback=False)
+        except ValueError:
+            error("Invalid value for reduce_lattice.")
 
-        return cls(latvecs, basis, basis_names_idx, basis_names, basis_coordsys,
-                   shift, shift_coordsys, bravais_cell)
+        geometry = cls(latvecs, basis, basis_names_idx, basis_names,
+                       basis_coordsys, shift, shift_coordsys, bravais_cell,
+                       reduce_lattice)
+        if reduce_lattice:
+            printstatus("Aspect ratio of the lattice cell: {:.3f} (before "
+                        "reduction: {:.3f})".format(
+                            cell_aspect_ratio(geometry.latvecs),
+                            cell_aspect_ratio(geometry.input_latvecs)))
+        return geometry
 
 
     def coord_transform(self, array, array_coordsys):
@@ -101,7 +144,7 @@ class Geometry:
             Cartesian coordinates.
         """
         if array_coordsys == "lattice":
-            return np.dot(array, self.latvecs)
+            return self.input_lattice.to_cartesian(array)
         elif array_coordsys == "cartesian":
             return array
         else:
@@ -118,52 +161,213 @@ class Geometry:
         Return:
             Coordintes folded into the central cell.
         """
-        invlatvecs = np.linalg.inv(self.latvecs)
-        basis = np.dot(basis, invlatvecs) % 1.0
-        return self.coord_transform(basis, "lattice")
+        basis = self.lattice.to_relative(basis) % 1.0
+        return self.lattice.to_cartesian(basis)
 
 
-    def gen_cuboid(self, cuboid, periodicity=None):
-        """Generates list of lattice points containing all points in a cuboid.
+    def lattice_indices(self, indices):
+        """Transforms lattice indices to the enumeration lattice vectors.
+        
+        Args:
+            indices: Integer coordinates with respect to the input lattice
+                vectors.
+        
+        Returns:
+            Integer coordinates of the same vectors with respect to the lattice
+            vectors used for the enumeration (latvecs attribute).
+        """
+        return np.round(np.dot(indices, self._invreduction)).astype(int)
+
+
+    def cuboid_index_bounds(self, cuboid):
+        """Returns the index range of the parallelepiped containing a cuboid.
         
         Args:
             cuboid: lower and upper ends of the cuboid.
-            periodicity: periodicity object.
             
         Returns:
-            Cartesian coordinates of the grid points.
+            Lowest and highest lattice indices (both inclusive) along each
+            lattice vector.
         """
-
         # Get the 8 corners of the cuboid
         mesh = np.mgrid[0:2,0:2,0:2].reshape(3, -1).transpose()
         abc_corners = [ [ cuboid[mm[0],0], cuboid[mm[1],1], cuboid[mm[2],2] ]
                           for mm in mesh ]
 
         # Get corners of the containing parallelepiped in relative coordinates
-        invlatvecs = np.linalg.inv(self.latvecs)
-        nmo_corners = np.dot(abc_corners, invlatvecs)
+        nmo_corners = self.lattice.to_relative(abc_corners)
         nmo_mininds = np.floor(nmo_corners.min(axis=0)).astype(int)
         nmo_maxinds = np.floor(nmo_corners.max(axis=0)).astype(int)
+        return nmo_mininds, nmo_maxinds
+
+
+    def cuboid_row_intervals(self, cuboid):
+        """Determines the lattice rows containing atoms inside a cuboid.
         
-        # Generate mesh indexing all points inside the parallelepiped
-        nallpoint = np.abs(np.prod(nmo_maxinds - nmo_mininds))
+        A row consists of the lattice points (i, j, k) with fixed i and j. For
+        every basis atom the six half-spaces of the cuboid give an interval of
+        k, for which the atom is inside the cuboid. The interval of the row is
+        the hull of the intervals of the basis atoms.
+        
+        Args:
+            cuboid: lower and upper ends of the cuboid.
+            
+        Returns:
+            Tuple with the (i, j) indices of the non-empty rows as (-1, 2)
+            shaped array, and the lowest and highest k index (both inclusive)
+            of each row.
+        """
+        nmo_mininds, nmo_maxinds = self.cuboid_index_bounds(cuboid)
+        rows = np.mgrid[nmo_mininds[0]:nmo_maxinds[0]+1,
+                        nmo_mininds[1]:nmo_maxinds[1]+1]
+        rows = rows.reshape(2, -1).transpose()
+        origins = np.dot(rows, self.latvecs[0:2])
+        kvec = self.latvecs[2]
+        
+        # Widen cuboid a bit, so that atoms on its faces are not lost
+        lower = cuboid[0] - DISTANCE_TOLERANCE
+        upper = cuboid[1] + DISTANCE_TOLERANCE
+        kmin = np.empty((len(rows), ), dtype=float)
+        kmax = np.empty((len(rows), ), dtype=float)
+        kmin.fill(np.inf)
+        kmax.fill(-np.inf)
+        for basisvec in self.basis:
+            kmin_basis = np.empty((len(rows), ), dtype=float)
+            kmax_basis = np.empty((len(rows), ), dtype=float)
+            kmin_basis.fill(-np.inf)
+            kmax_basis.fill(np.inf)
+            for cc in range(3):
+                # Condition: lower <= origin + basis + k * kvec <= upper
+                low = lower[cc] - origins[:,cc] - basisvec[cc]
+                high = upper[cc] - origins[:,cc] - basisvec[cc]
+                if abs(kvec[cc]) < EPSILON:
+                    outside = np.logical_or(low > 0.0, high < 0.0)
+                    kmax_basis[outside] = -np.inf
+                    continue
+                bound1 = low / kvec[cc]
+                bound2 = high / kvec[cc]
+                kmin_basis = np.maximum(kmin_basis,
+                                        np.minimum(bound1, bound2))
+                kmax_basis = np.minimum(kmax_basis,
+                                        np.maximum(bound1, bound2))
+            valid = kmin_basis <= kmax_basis
+            kmin[valid] = np.minimum(kmin[valid], kmin_basis[valid])
+            kmax[valid] = np.maximum(kmax[valid], kmax_basis[valid])
+        nonempty = kmin <= kmax
+        kmin = np.ceil(kmin[nonempty]).astype(int)
+        kmax = np.floor(kmax[nonempty]).astype(int)
+        rows = rows[nonempty]
+        nonempty = kmin <= kmax
+        return rows[nonempty], kmin[nonempty], kmax[nonempty]
+
+
+    def union_row_intervals(self, cuboids):
+        """Determines the lattice rows containing atoms inside some cuboids.
+        
+        The intervals returned by cuboid_row_intervals() for the individual
+        cuboids are merged, so that every lattice point is contained only
+        once, even if the cuboids overlap. Regions between the cuboids are
+        left out.
+        
+        Args:
+            cuboids: Lower and upper ends of the cuboids as (-1, 2, 3) shaped
+                array.
+            
+        Returns:
+            Tuple with the (i, j) indices of the rows as (-1, 2) shaped array,
+            and the lowest and highest k index (both inclusive) of each
+            interval. A row may appear several times with disjoint intervals.
+            The intervals are ordered by i, j and k.
+        """
+        parts = [ self.cuboid_row_intervals(cuboid) for cuboid in cuboids ]
+        rows = np.vstack([ part[0] for part in parts ])
+        kmin = np.concatenate([ part[1] for part in parts ])
+        kmax = np.concatenate([ part[2] for part in parts ])
+        if len(parts) == 1 or not len(rows):
+            return rows, kmin, kmax
+        order = np.lexsort(( kmin, rows[:,1], rows[:,0] ))
+        rows, kmin, kmax = rows[order], kmin[order], kmax[order]
+        
+        # Map the intervals on a common axis with gaps between the rows, so
+        # that overlapping intervals of one row can be merged in one pass.
+        newrow = np.ones((len(rows), ), dtype=bool)
+        newrow[1:] = np.any(rows[1:] != rows[:-1], axis=1)
+        span = int(kmax.max() - kmin.min()) + 2
+        offsets = (np.cumsum(newrow) - 1) * span - kmin.min()
+        gmin = kmin + offsets
+        gmax = np.maximum.accumulate(kmax + offsets)
+        starts = np.ones((len(rows), ), dtype=bool)
+        starts[1:] = gmin[1:] > gmax[:-1] + 1
+        starts = np.flatnonzero(starts)
+        ends = np.append(starts[1:], len(rows)) - 1
+        return rows[starts], kmin[starts], gmax[ends] - offsets[starts]
+
+
+    def iter_cuboid_rows(self, cuboid, chunksize=DEFAULT_CHUNK_SIZE,
+                         indices=False, slab=None):
+        """Generates the lattice points with atoms possibly inside a cuboid.
+        
+        Only the points in the intervals returned by cuboid_row_intervals()
+        are generated, the remaining points of the enclosing parallelepiped
+        are skipped. The points are ordered by their lattice indices i, j and
+        k.
+        
+        Args:
+            cuboid: lower and upper ends of the cuboid, or (-1, 2, 3) shaped
+                array of several cuboids. In the latter case only the lattice
+                rows of the individual cuboids are enumerated (see
+                union_row_intervals()).
+            chunksize: Maximal number of lattice points per block.
+            indices: Whether the lattice indices of the points should be
+                delivered as well.
+            slab: Range (start, end) of the first lattice index i, to which the
+                enumeration should be restricted, or None.
+            
+        Yields:
+            Cartesian coordinates of the grid points in the next block. If
+            indices is True, a tuple of the lattice indices and the Cartesian
+            coordinates.
+        """
+        cuboids = np.reshape(cuboid, (-1, 2, 3))
+        nmo_mininds, nmo_maxinds = self.cuboid_index_bounds(
+            np.array([ cuboids[:,0].min(axis=0), cuboids[:,1].max(axis=0) ]))
+        nparallel = int(np.prod(nmo_maxinds - nmo_mininds + 1))
+        rows, kmin, kmax = self.union_row_intervals(cuboids)
+        if slab is not None:
+            inslab = np.logical_and(rows[:,0] >= slab[0], rows[:,0] < slab[1])
+            rows, kmin, kmax = rows[inslab], kmin[inslab], kmax[inslab]
+        npoint = int(np.sum(kmax - kmin + 1))
         printstatus(
-            "Number of necessary grid points: {:d}".format(int(nallpoint)),
+            "Number of necessary grid points: {:d}".format(npoint),
             indentlevel=1)
-        nmo = np.mgrid[nmo_mininds[0]:nmo_maxinds[0]+1,
-                       nmo_mininds[1]:nmo_maxinds[1]+1,
-                       nmo_mininds[2]:nmo_maxinds[2]+1, ]
-        nmo = nmo.reshape(3, -1).transpose()
-        
-        # Throw away points in the parallelepiped which are farther away from
-        # the cuboid as the maximal size of the unit cell along given direction
-        abc = np.dot(nmo, self.latvecs)
-        buffer = np.max(np.abs(self.latvecs), axis=0)
-        cond1 = np.all(abc < cuboid[0] - buffer, axis=1)
-        cond2 = np.all(abc > cuboid[1] + buffer, axis=1)
-        inside = np.logical_not(np.logical_or(cond1, cond2))
-        return np.dot(nmo[inside], self.latvecs)
-    
+        if npoint:
+            printstatus(
+                "Overshoot of the enclosing parallelepiped avoided: "
+                "{:.2f}".format(nparallel / npoint), indentlevel=1)
+        for irow, nmo in iter_row_points(rows, kmin, kmax, chunksize):
+            if indices:
+                yield nmo, self.lattice.to_cartesian(nmo)
+            else:
+                yield self.lattice.to_cartesian(nmo)
+
+
+    def block_corners(self, mininds, size):
+        """Returns the corners of parallelepipeds containing blocks of cells.
+        
+        Args:
+            mininds: Lowest lattice indices of the blocks as (-1, 3) array.
+            size: Number of cells along each lattice vector in a block.
+            
+        Returns:
+            Cartesian coordinates of the 8 corners of each block as (-1, 8, 3)
+            shaped array. All atoms of the cells in a block are inside the
+            corresponding parallelepiped.
+        """
+        mesh = np.mgrid[0:2,0:2,0:2].reshape(3, -1).transpose() * size
+        nmo = np.asarray(mininds)[:,np.newaxis,:] + mesh
+        return self.lattice.to_cartesian(nmo)
+
+
     def get_atom_type_names(self):
         return self.basis_names
     
@@ -180,6 +384,24 @@ class Geometry:
         return self.basis_names[self.basis_names_idx[index]]
 
 
+    def get_species(self):
+        """Returns the distinct atom names and the species of the basis atoms.
+        
+        Returns:
+            List of the distinct names in the order of their first occurrence
+            in the basis and an array with the index of the name of every basis
+            atom in that list.
+        """
+        names = []
+        species = np.empty((len(self.basis), ), dtype=int)
+        for iatom in range(len(self.basis)):
+            name = self.get_name_of_atom(iatom)
+            if name not in names:
+                names.append(name)
+            species[iatom] = names.index(name)
+        return names, species
+
+
     def gen_atoms(self, lattice_points):
         """Returns the coordinates and index of each atom inside the cells
         corresponding to given lattice points.
@@ -193,11 +415,34 @@ class Geometry:
         """
         nbasis = len(self.basis)
         nlatpoint = len(lattice_points) 
-        atoms_coords = np.empty((nlatpoint * nbasis , 3), dtype=float)
-        # Taking longer loop (instead over range(len(basis)) to have nicer
-        # output with atoms being in the same cell having close indices.
-        for ii in range(nlatpoint):
-            atoms_coords[ii * nbasis : (ii + 1) * nbasis ] = (self.basis +
-                lattice_points[ii])
-        atoms_idx = np.resize(np.arange(nbasis), (nlatpoint * nbasis))
+        # Lattice point major order, so that atoms being in the same cell have
+        # close indices.
+        atoms_coords = (np.asarray(lattice_points)[:,np.newaxis,:]
+                        + self.basis).reshape(-1, 3)
+        atoms_idx = np.tile(np.arange(nbasis), nlatpoint)
         return atoms_coords, atoms_idx
+
+
+def iter_row_points(rows, kmin, kmax, chunksize=DEFAULT_CHUNK_SIZE):
+    """Expands row intervals into lattice indices block by block.
+    
+    Args:
+        rows: (i, j) indices of the rows as (-1, 2) shaped array.
+        kmin: Lowest k index in each row.
+        kmax: Highest k index in each row (inclusive).
+        chunksize: Maximal number of lattice points per block.
+        
+    Yields:
+        Row index of each point and lattice indices (i, j, k) of the next block
+        of points as (-1, 3) shaped integer array. Rows follow each other in the
+        given order, within a row the k index is increasing.
+    """
+    counts = kmax - kmin + 1
+    rowends = np.cumsum(counts)
+    rowstarts = rowends - counts
+    npoint = int(rowends[-1]) if len(rowends) else 0
+    for start in range(0, npoint, chunksize):
+        flatinds = np.arange(start, min(start + chunksize, npoint))
+        irow = np.searchsorted(rowends, flatinds, side="right")
+        kk = kmin[irow] + (flatinds - rowstarts[irow])
+        yield irow, np.column_stack(( rows[irow], kk ))
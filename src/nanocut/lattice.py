@@ -0,0 +1,131 @@
+import numpy as np
+
+__all__ = [ "LatticeTransforms" ]
+
+
+class LatticeTransforms:
+    """Transformation matrices between cartesian and lattice coordinates.
+    
+    The matrices are calculated once on creation, so that the conversions do
+    not have to invert the lattice vectors again. For less than three lattice
+    vectors (periodic cells of 1D and 2D structures), the relative
+    coordinates of the projection onto the spawned line or plane are
+    returned, dropping the perpendicular components.
+    
+    Attributes:
+        direct: Lattice vectors as rows, shape (n, 3).
+        inverse: Matrix converting cartesian into relative coordinates,
+            shape (3, n).
+        reciprocal: Reciprocal lattice vectors (without the factor 2 pi) as
+            rows, shape (n, 3).
+        metric: Metric tensor (scalar products of the lattice vectors), shape
+            (n, n).
+    """
+
+    def __init__(self, latvecs):
+        """Initializes the transformations.
+        
+        Args:
+            latvecs: One, two or three linearly independent lattice vectors
+                as rows.
+        """
+        self.direct = np.array(latvecs, dtype=float)
+        self.direct.shape = (-1, 3)
+        nvec = len(self.direct)
+        if nvec == 1:
+            self.inverse = self.direct.transpose() / np.sum(self.direct[0]**2)
+        elif nvec == 2:
+            self.inverse = np.linalg.inv(np.array([
+                self.direct[0], self.direct[1],
+                np.cross(self.direct[0], self.direct[1]) ]))[:,0:2]
+        else:
+            self.inverse = np.linalg.inv(self.direct)
+        self.reciprocal = self.inverse.transpose()
+        self.metric = np.dot(self.direct, self.direct.transpose())
+
+
+    def __len__(self):
+        return len(self.direct)
+
+
+    def to_cartesian(self, relative, out=None):
+        """Converts relative coordinates into cartesian ones.
+        
+        Args:
+            relative: Relative coordinates, shape (-1, n).
+            out: C-contiguous float array of shape (-1, 3) to store the result
+                in or None.
+        
+        Returns:
+            Cartesian coordinates (out, if specified).
+        """
+        return np.dot(relative, self.direct, out=out)
+
+
+    def to_relative(self, cartesian, out=None):
+        """Converts cartesian coordinates into relative ones.
+        
+        Args:
+            cartesian: Cartesian coordinates, shape (-1, 3).
+            out: C-contiguous float array of shape (-1, n) to store the result
+                in or None.
+        
+        Returns:
+            Relative coordinates (out, if specified).
+        """
+        return np.dot(cartesian, self.inverse, out=out)
+
+
+    def cells(self, cartesian, tolerance=0.0, out=None):
+        """Returns the cells containing the given points.
+        
+        Args:
+            cartesian: Cartesian coordinates, shape (-1, 3).
+            tolerance: Relative coordinates closer than this to the upper
+                boundary of a cell are attributed to the next cell.
+            out: C-contiguous float array of shape (-1, n) to store the result
+                in or None.
+        
+        Returns:
+            Relative coordinates of the origins of the cells (out, if
+            specified).
+        """
+        cells = np.dot(cartesian, self.inverse, out=out)
+        if tolerance:
+            cells += tolerance
+        return np.floor(cells, out=cells)
+
+
+    def fold(self, cartesian, tolerance=0.0, out=None):
+        """Folds cartesian coordinates into the central cell.
+        
+        Args:
+            cartesian: Cartesian coordinates, shape (-1, 3).
+            tolerance: Tolerance for the cell boundaries (see cells()).
+            out: Float array of shape (-1, 3) to store the result in or None.
+                It may be the same as cartesian.
+        
+        Returns:
+            Cartesian coordinates with relative coordinates between 0 and 1
+            (out, if specified).
+        """
+        cells = self.cells(cartesian, tolerance)
+        if out is None:
+            return cartesian - np.dot(cells, self.direct)
+        if out is not cartesian:
+            out[...] = cartesian
+        out -= np.dot(cells, self.direct)
+        return out
+
+
+    def miller_to_normal(self, miller_indices):
+        """Calculates the normal vectors of planes defined by Miller indices.
+        
+        Args:
+            miller_indices: Miller indices, shape (-1, n).
+        
+        Returns:
+            Cartesian normal vector(s) of the plane(s). Their lengths are the
+            inverse spacings of the lattice planes with those indices.
+        """
+        return np.dot(miller_indices, self.reciprocal)
@@ -1,5 +1,6 @@
 import sys
 from collections import OrderedDict
+import numpy as np
 
 # Verbosity level
 verbosity = 1
@@ -7,6 +8,9 @@ verbosity = 1
 # Indentation string in messages
 INDENT_STR = " " * 2
 
+# Number of atoms loaded into memory at once when writing the structure
+WRITE_CHUNK_SIZE = 65536
+
 def write_crystal(geometry, atoms_coords, atoms_idx, axis, resultfilename,
                   append, gen, latvecsfilename):
     """Write out the resulting crystaline structure.
@@ -43,7 +47,7 @@ def write_crystal(geometry, atoms_coords, atoms_idx, axis, resultfilename,
 
     # Write geometry
     try:
-        mode = "w+" if append else "w"
+        mode = "a" if append else "w"
         fp = open(resultfilename, mode)
     except IOError:
         error("Can't open '" + resultfilename + "'.")
@@ -67,10 +71,11 @@ def writexyz(fp, atoms_idx, atoms_coords, geometry, comment):
     """
     natom = atoms_idx.shape[0]
     fp.write("{:d}\n{:s}\n".format(natom, comment))
-    for it in range(len(atoms_coords)):
-        fp.write(" {:<3s} {:18.10f} {:18.10f} {:18.10f}\n".format(
-                geometry.get_name_of_atom(atoms_idx[it]),
-                *atoms_coords[it,:]))
+    for chunk_coords, chunk_idx in iter_chunks(atoms_coords, atoms_idx):
+        for it in range(len(chunk_coords)):
+            fp.write(" {:<3s} {:18.10f} {:18.10f} {:18.10f}\n".format(
+                    geometry.get_name_of_atom(chunk_idx[it]),
+                    *chunk_coords[it,:]))
 
         
 def writegen(fp, atoms_idx, atoms_coords, geometry, axis):
@@ -94,16 +99,35 @@ def writegen(fp, atoms_idx, atoms_coords, geometry, axis):
         fp.write("{:d} C\n".format(natom))
 
     fp.write(" " + " ".join(atomdict.keys()) + "\n")
-    for ii in range(len(atoms_coords)):
-        fp.write(" {:5d} {:3d} {:18.10f} {:18.10f} {:18.10f}\n".format(
-            ii + 1, atomdict[geometry.get_name_of_atom(atoms_idx[ii])] + 1,
-            *atoms_coords[ii]))
+    ii = 0
+    for chunk_coords, chunk_idx in iter_chunks(atoms_coords, atoms_idx):
+        for it in range(len(chunk_coords)):
+            fp.write(" {:5d} {:3d} {:18.10f} {:18.10f} {:18.10f}\n".format(
+                ii + 1, atomdict[geometry.get_name_of_atom(chunk_idx[it])] + 1,
+                *chunk_coords[it]))
+            ii += 1
     if len(axis):
         fp.write("{0:18.10f} {0:18.10f} {0:18.10f}\n".format(0.0))
         for vec in axis:
             fp.write("{:18.10f} {:18.10f} {:18.10f}\n".format(*vec))
 
 
+def iter_chunks(atoms_coords, atoms_idx, chunksize=WRITE_CHUNK_SIZE):
+    """Delivers the atoms in chunks loaded into memory.
+    
+    Args:
+        atoms_coords: Coordinates of the atoms (may be memory mapped).
+        atoms_idx: Type index of the atoms (may be memory mapped).
+        chunksize: Number of atoms per chunk.
+        
+    Yields:
+        Coordinates and type indices of the atoms in the next chunk.
+    """
+    for start in range(0, len(atoms_coords), chunksize):
+        end = min(start + chunksize, len(atoms_coords))
+        yield np.array(atoms_coords[start:end]), np.array(atoms_idx[start:end])
+
+
 def error(msg):
     """Write error message and exit.
     
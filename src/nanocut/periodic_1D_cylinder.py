@@ -12,6 +12,9 @@ class Periodic1DCylinder(Cylinder):
                  "radius": ( "float", None, False, False )
                  }
 
+    # Periodic images of the atoms must be masked out
+    periodic = True
+
     def __init__(self, geometry, period, **kwargs):
         """Creates a Periodic1DCylinder instance.
         
@@ -32,10 +35,8 @@ class Periodic1DCylinder(Cylinder):
         Cylinder.__init__(self, geometry, period, **kwargs)
 
         
-    def atoms_inside(self, atoms):
-        """Decides which atoms are inside the body (see Body class)."""
+    def mask_unique(self, atoms, mask, seen=None):
+        """Masks out periodic images of atoms (see Body class)."""
         
-        atoms_inside = Cylinder.atoms_inside(self, atoms)
-        atoms_inside *= self.periodicity.mask_unique(atoms - self.shift_vector,
-                                                     atoms_inside)
-        return atoms_inside
+        return self.periodicity.mask_unique(atoms - self.shift_vector, mask,
+                                            seen)
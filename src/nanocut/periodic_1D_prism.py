@@ -6,6 +6,8 @@ from nanocut.output import error
 class Periodic1DPrism(Polyhedron):
     """Class for periodic bodies bounded by a group of planes."""
     
+    # Periodic images of the atoms must be masked out
+    periodic = True
 
     def __init__(self, geometry, period, **kwargs):
         """Construct Periodic1DPrism instance.
@@ -38,10 +40,8 @@ class Periodic1DPrism(Polyhedron):
         Polyhedron.__init__(self, geometry, period, **kwargs)
                        
 
-    def atoms_inside(self, atoms):
-        """Decides which atoms are inside the body (see Body class)."""
+    def mask_unique(self, atoms, mask, seen=None):
+        """Masks out periodic images of atoms (see Body class)."""
         
-        atoms_inside_body = Polyhedron.atoms_inside(self, atoms)
-        atoms_inside_body *= self.periodicity.mask_unique(
-            atoms - self.shift_vector, atoms_inside_body)
-        return atoms_inside_body
+        return self.periodicity.mask_unique(atoms - self.shift_vector, mask,
+                                            seen)
@@ -1,6 +1,8 @@
 import numpy as np
-from nanocut.common import PERIODIC_TOLERANCE
+from nanocut.common import PERIODIC_TOLERANCE, LAYER_TOLERANCE
 from nanocut.polyhedron import Polyhedron
+from nanocut.periodicity import gcd
+from nanocut.symmetry import internal_translations
 
 class Periodic2DPlane(Polyhedron):
     """Class for plane elements with 2D periodicity"""
@@ -11,6 +13,9 @@ class Periodic2DPlane(Polyhedron):
                  "thickness": ( "float", None, False, False )
                 }
 
+    # Periodic images of the atoms must be masked out
+    periodic = True
+
     def __init__(self, geometry, period, **kwargs):
         """Construct Periodic2DPlane instance.
         
@@ -24,6 +29,7 @@ class Periodic2DPlane(Polyhedron):
         # Surface normal vector
         surfnorm = np.cross(axis1, axis2).astype(float)
         surfnorm = surfnorm / np.linalg.norm(surfnorm)
+        self.surfnorm = surfnorm
         # Normal vector of the side planes of the polyhedron, pointing inwards
         n1 = np.cross(surfnorm, axis1)
         n1 /= np.linalg.norm(n1)
@@ -48,10 +54,95 @@ class Periodic2DPlane(Polyhedron):
         Polyhedron.__init__(self, geometry, period, **kwargs)
 
 
-    def atoms_inside(self, atoms):
-        """Decides which atoms are inside the body (see Body class)."""
+    def mask_unique(self, atoms, mask, seen=None):
+        """Masks out periodic images of atoms (see Body class)."""
+        
+        return self.periodicity.mask_unique(atoms - self.shift_vector, mask,
+                                            seen)
+
+
+    def layer_offsets(self, geometry):
+        """Returns the positions of the atomic layers along the surface normal.
+        
+        The basis atoms are projected onto the surface normal, as all lattice
+        translations shift them by multiples of the interlayer period. Layers
+        mapped onto each other by translations of the crystal, which are not
+        lattice vectors (e.g. for a face centered crystal given with a simple
+        cubic lattice), are equivalent and only reported once.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+        
+        Returns:
+            Distinct heights of the atomic layers above the lower plane of the
+            slab, folded into one period (sorted), and the period of the
+            crystal along the surface normal.
+        """
+        axis = self.periodicity.get_axis("lattice")
+        miller = np.cross(axis[0], axis[1])
+        miller = miller // gcd(abs(miller))
+        normal = geometry.input_lattice.miller_to_normal(miller)
+        layerperiod = 1.0 / np.linalg.norm(normal)
+        translations = internal_translations(geometry, LAYER_TOLERANCE)
+        shifts = np.mod(np.dot(translations, self.surfnorm)
+                        + LAYER_TOLERANCE, layerperiod) - LAYER_TOLERANCE
+        shifts = shifts[shifts > LAYER_TOLERANCE]
+        if len(shifts):
+            layerperiod = np.min(shifts)
+        lower = np.dot(self.surfnorm, self.shift_vector) - self.thickness / 2.0
+        heights = np.mod(np.dot(geometry.basis, self.surfnorm) - lower
+                         + LAYER_TOLERANCE, layerperiod) - LAYER_TOLERANCE
+        heights = np.sort(heights)
+        distinct = np.ones((len(heights), ), dtype=bool)
+        distinct[1:] = np.diff(heights) > LAYER_TOLERANCE
+        return heights[distinct], layerperiod
+
+
+    def termination_body(self, geometry):
+        """Returns a slab containing the atoms of all distinct terminations.
         
-        atoms_inside_body = Polyhedron.atoms_inside(self, atoms)
-        atoms_inside_body *= self.periodicity.mask_unique(
-            atoms - self.shift_vector, atoms_inside_body)
-        return atoms_inside_body
+        Each termination is a slab with the thickness of the current one,
+        whose lower plane is shifted upwards onto one of the atomic layers
+        within one period of the lattice along the surface normal.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+        
+        Returns:
+            Periodic2DPlane instance containing all terminations and the
+            heights of the lower planes of the terminations along the surface
+            normal (see termination_masks()).
+        """
+        offsets, layerperiod = self.layer_offsets(geometry)
+        lower = np.dot(self.surfnorm, self.shift_vector) - self.thickness / 2.0
+        # Centre of the enclosing slab, keeping the in-plane shift
+        center = (self.shift_vector
+                  + (layerperiod / 2.0 - LAYER_TOLERANCE) * self.surfnorm)
+        body = Periodic2DPlane(geometry, self.periodicity,
+                               thickness=(self.thickness + layerperiod
+                                          + 4.0 * LAYER_TOLERANCE),
+                               shift_vector=center,
+                               shift_vector_coordsys="cartesian")
+        return body, lower + offsets
+
+
+    def termination_masks(self, atoms_coords, lowers):
+        """Selects the atoms of the slab terminations.
+        
+        Atoms on the lower plane of a termination belong to it, atoms on its
+        upper plane do not (so that the terminations are well defined, even if
+        the thickness is a multiple of the interlayer distance).
+        
+        Args:
+            atoms_coords: Cartesian coordinates of the atoms in the slab
+                returned by termination_body().
+            lowers: Heights of the lower planes of the terminations.
+        
+        Returns:
+            Logical array of shape (ntermination, natom) with True for the atoms
+            of each termination.
+        """
+        heights = np.dot(atoms_coords, self.surfnorm)
+        lowers = np.asarray(lowers)[:,np.newaxis] - LAYER_TOLERANCE
+        return np.logical_and(heights >= lowers,
+                              heights < lowers + self.thickness)
@@ -10,6 +10,9 @@ class Periodic3DSupercell(Polyhedron):
                  "shift_vector": ( "floatarray", (3,), True, True ),
                 }
 
+    # Periodic images of the atoms must be masked out
+    periodic = True
+
     def __init__(self, geometry, period, **kwargs):
         """Construct Periodic3DSupercell instance.
         
@@ -48,10 +51,8 @@ class Periodic3DSupercell(Polyhedron):
         Polyhedron.__init__(self, geometry, period, **kwargs)
 
 
-    def atoms_inside(self, atoms):
-        """Decides which atoms are inside the body (see Body class)."""
+    def mask_unique(self, atoms, mask, seen=None):
+        """Masks out periodic images of atoms (see Body class)."""
         
-        atoms_inside_body = Polyhedron.atoms_inside(self, atoms)
-        atoms_inside_body *= self.periodicity.mask_unique(
-            atoms - self.shift_vector, atoms_inside_body)
-        return atoms_inside_body
+        return self.periodicity.mask_unique(atoms - self.shift_vector, mask,
+                                            seen)
@@ -1,9 +1,21 @@
+import itertools
 import numpy as np
 import nanocut.common as nc 
 from nanocut.output import error, printstatus
+from nanocut.lattice import LatticeTransforms
 
 __all__ = [ "Periodicity", ]
 
+# Direction for sorting points when searching for close pairs. (Should not be
+# parallel to any low index lattice plane.)
+SWEEP_DIRECTION = np.array([ 0.5361, 0.6212, 0.5716 ])
+SWEEP_DIRECTION /= np.linalg.norm(SWEEP_DIRECTION)
+
+# Cartesian directions without periodicity after rotating the structure into
+# standard form (see Periodicity.rotate_coordsys())
+NONPERIODIC_DIRECTIONS = { "0D": [ 0, 1, 2 ], "1D": [ 0, 1 ], "2D": [ 2 ],
+                           "3D": [] }
+
 
 def gcd(numbers):
     """Calculates greatest common divisor of a list of numbers."""
@@ -15,6 +27,104 @@ def gcd(numbers):
     return aa
 
 
+def close_pairs(points, tolerance):
+    """Finds the pairs of points being closer to each other than a tolerance.
+    
+    The points are sorted by their projection on a generic direction and
+    swept, so that only points with nearly equal projections are compared.
+    
+    Args:
+        points: Cartesian coordinates of the points.
+        tolerance: Distance below which points are considered close.
+        
+    Returns:
+        Indices of the first and the second point of the pairs. The first index
+        is always smaller than the second one.
+    """
+    projections = np.dot(points, SWEEP_DIRECTION)
+    order = np.argsort(projections, kind="stable")
+    projections = projections[order]
+    first = [ np.empty((0, ), dtype=int) ]
+    second = [ np.empty((0, ), dtype=int) ]
+    for offset in range(1, len(points)):
+        near = np.flatnonzero(projections[offset:] - projections[:-offset]
+                              < tolerance)
+        if not len(near):
+            break
+        ind1 = order[near]
+        ind2 = order[near + offset]
+        dists2 = np.sum((points[ind1] - points[ind2])**2, axis=1)
+        close = np.flatnonzero(dists2 < tolerance**2)
+        first.append(np.minimum(ind1[close], ind2[close]))
+        second.append(np.maximum(ind1[close], ind2[close]))
+    return np.concatenate(first), np.concatenate(second)
+
+
+def hermite_normal_form(axis):
+    """Returns the Hermite normal form of integer axis vectors.
+    
+    Args:
+        axis: Linearly independent integer vectors as (-1, 3) array.
+        
+    Returns:
+        Tuple (hnf, basis) with the lower triangular integer matrix hnf with
+        positive diagonal and the unimodular integer matrix basis, so that
+        axis = hnf * basis. The rows of basis span the same lattice as the unit
+        vectors, and every axis vector is a combination of its first len(axis)
+        rows.
+    """
+    hnf = np.array(axis, dtype=int).reshape(-1, 3)
+    trafo = np.eye(3, dtype=int)
+    # Column operations (Euclidean algorithm) eliminating the upper triangle
+    for irow in range(len(hnf)):
+        for icol in range(irow + 1, 3):
+            while hnf[irow, icol] != 0:
+                quot = hnf[irow, irow] // hnf[irow, icol]
+                hnf[:,irow] -= quot * hnf[:,icol]
+                trafo[:,irow] -= quot * trafo[:,icol]
+                hnf[:,[ irow, icol ]] = hnf[:,[ icol, irow ]]
+                trafo[:,[ irow, icol ]] = trafo[:,[ icol, irow ]]
+        if hnf[irow, irow] < 0:
+            hnf[:,irow] *= -1
+            trafo[:,irow] *= -1
+    basis = np.round(np.linalg.inv(trafo)).astype(int)
+    return hnf, basis
+
+
+def _lexless(first, second):
+    """Compares the rows of two integer arrays lexicographically.
+    
+    Returns:
+        Logical array with True where the row of first is smaller.
+    """
+    less = np.zeros((len(first), ), dtype=bool)
+    equal = np.ones((len(first), ), dtype=bool)
+    for icol in range(first.shape[1]):
+        less |= equal & (first[:,icol] < second[:,icol])
+        equal &= first[:,icol] == second[:,icol]
+    return less
+
+
+def _lattice_order(cells, atoms_idx, nbasis):
+    """Returns the order of atoms in the lattice grid.
+    
+    Args:
+        cells: Lattice indices of the cells of the atoms.
+        atoms_idx: Type indices of the atoms.
+        nbasis: Number of basis atoms.
+        
+    Returns:
+        Indices sorting the atoms lexicographically by their cells and their
+        type indices.
+    """
+    if not len(cells):
+        return np.empty((0, ), dtype=int)
+    lower = cells.min(axis=0)
+    keys = np.ravel_multi_index((cells - lower).T,
+                                cells.max(axis=0) - lower + 1)
+    return np.argsort(keys * nbasis + atoms_idx, kind="stable")
+
+
 def plane_axis_from_miller(miller):
     """Returns two vectors in a plane with given miller index.
     
@@ -57,19 +167,19 @@ def plane_axis_from_miller(miller):
     return axis
 
 
-def cell_axis_from_superlattice(superlattice, latvecs):
+def cell_axis_from_superlattice(superlattice, lattice):
     """Returns three vectors spawning a supercell similar to a given one.
     
     Args:
         superlattice: Lattice vectors of the supercell.
-        latvecs: Original lattice vectors.
+        lattice: Transformations (LatticeTransforms) of the original lattice.
         
     Returns:
         Three vectors in relative coordinates (respective the original lattice
         vectors) which spawn a superlattice similar to the specified one.
     """ 
     # Transformation to build superlattice from current lattice vectors.
-    trans = np.dot(superlattice, np.linalg.inv(latvecs))
+    trans = lattice.to_relative(superlattice)
     # Rescale transformation matrix to contain only elements >= 1.0.
     nonzero = np.nonzero(np.greater(np.abs(trans), nc.EPSILON))
     trans_nonzero = trans[nonzero]
@@ -89,13 +199,205 @@ def cell_axis_from_superlattice(superlattice, latvecs):
         error("Target lattice and source lattices probably incompatible")
     # Simplify transformation matrix with greatest common divisor.
     factor = gcd(abs(trans_nonzero_int.flatten()))
-    trans_nonzero_int /= factor
+    trans_nonzero_int //= factor
     # Fill nonzero components into axis.
     axis = np.zeros((3, 3), dtype=int)
     axis[nonzero] = trans_nonzero_int
     return axis
     
 
+def search_supercell(latvecs, ncell, shape="cubic",
+                     tolerance=nc.SUPERCELL_SIZE_TOLERANCE,
+                     searchrange=nc.SUPERCELL_SEARCH_RANGE):
+    """Searches the most cubic or most isotropic supercell of a given size.
+    
+    The integer transformation matrices in the neighbourhood of the one, which
+    would transform the lattice into a cube of the requested volume, are
+    evaluated in vectorized batches.
+    
+    Args:
+        latvecs: Lattice vectors.
+        ncell: Requested number of lattice cells in the supercell.
+        shape: "cubic" to minimize the deviation of the metric of the supercell
+            from the metric of a cube, "isotropic" to maximize the shortest
+            distance between periodic images.
+        tolerance: Allowed relative deviation of the number of cells.
+        searchrange: Maximal deviation of the matrix elements from the ones of
+            the ideal transformation.
+    
+    Returns:
+        Axis vectors of the supercell in relative coordinates or None, if no
+        matrix with an appropriate determinant was found.
+    """
+    volume = abs(np.linalg.det(latvecs))
+    ideal = (ncell * volume)**(1.0 / 3.0) * np.linalg.inv(latvecs)
+    center = np.round(ideal).astype(int).flatten()
+    offsets = np.arange(-searchrange, searchrange + 1)
+    mindet = max(1, int(np.ceil(ncell * (1.0 - tolerance))))
+    maxdet = max(mindet, int(np.floor(ncell * (1.0 + tolerance))))
+    nmatrix = len(offsets)**9
+    best_axis = None
+    best_key = None
+    for start in range(0, nmatrix, nc.SUPERCELL_BATCH_SIZE):
+        digits = np.unravel_index(
+            np.arange(start, min(start + nc.SUPERCELL_BATCH_SIZE, nmatrix)),
+            (len(offsets), ) * 9)
+        matrices = (center + offsets[np.column_stack(digits)]).reshape(-1, 3, 3)
+        dets = _integer_det(matrices)
+        matrices = matrices[(dets >= mindet) & (dets <= maxdet)]
+        if not len(matrices):
+            continue
+        cells = np.dot(matrices, latvecs)
+        scale = np.abs(np.linalg.det(cells))**(1.0 / 3.0)
+        if shape == "cubic":
+            metric = np.einsum("nij,nkj->nik", cells, cells)
+            scores = np.sqrt(np.sum(
+                (metric / scale[:,np.newaxis,np.newaxis]**2 - np.eye(3))**2,
+                axis=(1, 2)))
+        else:
+            bound = None if best_key is None else -best_key[0]
+            scores = -_shortest_images(cells, searchrange, bound) / scale
+        # Prefer the shape, then the size closest to the requested one
+        sizediffs = np.abs(_integer_det(matrices) - ncell)
+        ibest = np.lexsort(( sizediffs, np.round(scores, 8) ))[0]
+        key = ( round(scores[ibest], 8), sizediffs[ibest] )
+        if best_key is None or key < best_key:
+            best_key = key
+            best_axis = matrices[ibest]
+    if best_axis is None:
+        return None
+    return reduce_axis(best_axis, latvecs)
+
+
+def _shortest_images(cells, maxcoeff, bound=None):
+    """Returns the shortest distance between periodic images in cells.
+    
+    Args:
+        cells: Lattice vectors of the cells as (-1, 3, 3) array.
+        maxcoeff: Maximal absolute coefficient of the lattice translations
+            considered.
+        bound: Distance relative to the cube root of the volume or None. Cells
+            for which the translations with coefficients of at most one are
+            already shorter are not investigated further.
+    
+    Returns:
+        Shortest image distance of each cell (only an upper bound for cells
+        excluded via bound).
+    """
+    distances = np.empty((len(cells), ), dtype=float)
+    near = np.array([ vec for vec in itertools.product((-1, 0, 1), repeat=3)
+                      if vec > (0, 0, 0) ])
+    images = np.einsum("ti,nij->ntj", near, cells)
+    distances[:] = np.sqrt(np.min(np.sum(images**2, axis=2), axis=1))
+    if bound is not None:
+        scale = np.abs(np.linalg.det(cells))**(1.0 / 3.0)
+        check = np.flatnonzero(distances >= bound * scale)
+    else:
+        check = np.arange(len(cells))
+    translations = np.array([ vec for vec in itertools.product(
+        range(-maxcoeff, maxcoeff + 1), repeat=3)
+                              if vec > (0, 0, 0) and max(map(abs, vec)) > 1 ])
+    if len(check) and len(translations):
+        images = np.einsum("ti,nij->ntj", translations, cells[check])
+        distances[check] = np.minimum(
+            distances[check], np.sqrt(np.min(np.sum(images**2, axis=2),
+                                             axis=1)))
+    return distances
+
+
+def _integer_det(matrices):
+    """Returns the determinants of integer (-1, 3, 3) matrices exactly."""
+    return (matrices[:,0,0] * (matrices[:,1,1] * matrices[:,2,2]
+                               - matrices[:,1,2] * matrices[:,2,1])
+            - matrices[:,0,1] * (matrices[:,1,0] * matrices[:,2,2]
+                                 - matrices[:,1,2] * matrices[:,2,0])
+            + matrices[:,0,2] * (matrices[:,1,0] * matrices[:,2,1]
+                                 - matrices[:,1,1] * matrices[:,2,0]))
+
+
+def reduce_axis(axis, latvecs, delta=0.99):
+    """Returns the shortest and most orthogonal equivalent axis vectors.
+    
+    The axis vectors are reduced with the algorithm of Lenstra, Lenstra and
+    Lovasz (for two vectors it is equivalent to the reduction of Lagrange and
+    Gauss). The orientation of the cell is kept.
+    
+    Args:
+        axis: Axis vectors in relative coordinates.
+        latvecs: Lattice vectors.
+        delta: Parameter of the Lovasz condition (between 0.25 and 1.0).
+        
+    Returns:
+        Axis vectors in relative coordinates, spanning the same superlattice.
+    """
+    axis = np.array(axis, dtype=int).reshape(-1, 3)
+    reduced = axis.copy()
+    kk = 1
+    while kk < len(reduced):
+        # Size reduction of vector kk against the previous ones
+        for jj in range(kk - 1, -1, -1):
+            ortho, mu = _gram_schmidt(np.dot(reduced, latvecs))
+            factor = int(np.round(mu[kk, jj]))
+            if factor:
+                reduced[kk] -= factor * reduced[jj]
+        ortho, mu = _gram_schmidt(np.dot(reduced, latvecs))
+        norm2 = np.sum(ortho**2, axis=1)
+        if norm2[kk] >= (delta - mu[kk, kk - 1]**2) * norm2[kk - 1]:
+            kk += 1
+        else:
+            reduced[[ kk - 1, kk ]] = reduced[[ kk, kk - 1 ]]
+            kk = max(kk - 1, 1)
+    # Restore orientation of the cell
+    if len(reduced) == 2:
+        old = np.cross(*np.dot(axis, latvecs))
+        new = np.cross(*np.dot(reduced, latvecs))
+        if np.dot(old, new) < 0.0:
+            reduced[1] *= -1
+    elif len(reduced) == 3:
+        if np.linalg.det(reduced) * np.linalg.det(axis) < 0.0:
+            reduced *= -1
+    return reduced
+
+
+def _gram_schmidt(vectors):
+    """Returns the Gram-Schmidt orthogonalized vectors and the coefficients
+    of the original vectors with respect to them."""
+    ortho = np.array(vectors, dtype=float)
+    mu = np.eye(len(ortho))
+    for ii in range(len(ortho)):
+        for jj in range(ii):
+            mu[ii, jj] = (np.dot(vectors[ii], ortho[jj])
+                          / np.dot(ortho[jj], ortho[jj]))
+            ortho[ii] -= mu[ii, jj] * ortho[jj]
+    return ortho, mu
+
+
+def cell_aspect_ratio(axis_cart):
+    """Returns the aspect ratio of a cell.
+    
+    Args:
+        axis_cart: Axis vectors in cartesian coordinates.
+        
+    Returns:
+        Length of the longest axis vector divided by the smallest distance
+        between opposite faces (edges for 2D cells) of the cell. It is 1.0 for
+        square and cubic cells and grows with the skewness of the cell.
+    """
+    axis_cart = np.array(axis_cart, dtype=float).reshape(-1, 3)
+    lengths = np.linalg.norm(axis_cart, axis=1)
+    if len(axis_cart) == 2:
+        area = np.linalg.norm(np.cross(axis_cart[0], axis_cart[1]))
+        heights = area / lengths[::-1]
+    elif len(axis_cart) == 3:
+        volume = abs(np.linalg.det(axis_cart))
+        heights = volume / np.linalg.norm(
+            np.cross(np.roll(axis_cart, -1, axis=0),
+                     np.roll(axis_cart, -2, axis=0)), axis=1)
+    else:
+        heights = lengths
+    return lengths.max() / heights.min()
+
+
 class Periodicity:
     """Holds information about type of periodicity, and axes.
     
@@ -103,15 +405,24 @@ class Periodicity:
         period_type: Type of the periodicity ("0D", "1D", "2D" or "3D")
         axis: Axis vector(s) in relatvie coordinates.
         axis_cart: Axis vector(s) in cartesian coordinates.
+        enum_axis: Axis vector(s) with respect to the lattice vectors used for
+            the enumeration of the lattice points (see Geometry).
+        repetition: Number of repetitions of the primitive cell along each
+            axis vector.
+        cell: Transformations (LatticeTransforms) of the axis vectors. The
+            relative coordinates refer to the axis vectors, the directions
+            perpendicular to them are dropped.
     """
 
-    def __init__(self, geometry, period_type, axis=None):
+    def __init__(self, geometry, period_type, axis=None, repetition=None):
         """Initialized Periodicity instance.
         
         Args:
             geometry: Geometry object to provide transformation.
             period_type: Periodicity type ("0D", "1D", "2D", "3D").
             axis: (3, -1) array with periodicity vectors in relative coords.
+            repetition: Number of repetitions of the primitive cell contained
+                in the axis vectors (default: 1 for each vector).
         """
         self.period_type = period_type
         if self.period_type not in [ "0D", "1D", "2D", "3D" ]:
@@ -119,17 +430,30 @@ class Periodicity:
         if self.period_type == "0D":
             self.axis = None
             self.axis_cart = None
+            self.enum_axis = None
+            self.repetition = None
+            self.cell = None
+            self._standard = None
             return
         self.axis = np.array(axis, dtype=int)
         self.axis.shape = (-1, 3)
         self.axis_cart = geometry.coord_transform(self.axis, "lattice")
+        self.enum_axis = geometry.lattice_indices(self.axis)
+        if repetition is None:
+            self.repetition = np.ones((len(self.axis), ), dtype=int)
+        else:
+            self.repetition = np.array(repetition, dtype=int)
+        self.cell = LatticeTransforms(self.axis_cart)
+        self._standard = None
 
 
-    def rotate_coordsys(self, atoms_coords):
+    def rotate_coordsys(self, atoms_coords, chunksize=None):
         """Rotates coordinate system to have standardized z-axis.
         
         Args:
             atom_coords: Cordinate to rotate.
+            chunksize: If given, the coordinates are rotated in place in chunks
+                of the given number of atoms (e.g. for memory mapped arrays).
             
         Returns:
             New translational vectors and rotated coordinates. For 0D systems it
@@ -140,14 +464,94 @@ class Periodicity:
             For 3D systems it returns lattice vectors and atom coordinates
             unchanged.
         """
+        axis, rotation_matrix = self._standard_rotation()
+        if rotation_matrix is None:
+            return axis, atoms_coords
+        if chunksize is None:
+            atoms_coords = np.dot(atoms_coords, rotation_matrix)
+        else:
+            for start in range(0, len(atoms_coords), chunksize):
+                end = min(start + chunksize, len(atoms_coords))
+                atoms_coords[start:end] = np.dot(atoms_coords[start:end],
+                                                 rotation_matrix)
+        return axis, atoms_coords
+
+
+    def standardize_coords(self, atoms_coords, out=None, recenter=False,
+                           chunksize=nc.TRANSFORM_CHUNK_SIZE):
+        """Folds atoms into the unit cell and rotates them to standard form.
+        
+        Folding and rotation are done in one pass with precomputed matrices:
+        the rotated coordinates are shifted by the rotated axis vectors times
+        the number of cells the atoms are away from the central one. Relative
+        coordinates within RELATIVE_PERIODIC_TOLERANCE below 1.0 are folded to
+        the lower boundary of the cell (as in mask_unique()).
+        
+        Args:
+            atoms_coords: Cartesian coordinates of the atoms (may be memory
+                mapped).
+            out: Array to store the transformed coordinates in. It may be
+                atoms_coords itself. If None, a new array is allocated.
+            recenter: Whether the structure should be shifted so that the
+                centre of its bounding box is at the origin along the
+                non-periodic directions.
+            chunksize: Number of atoms transformed at once.
+        
+        Returns:
+            Translational vectors (see rotate_coordsys()) and the transformed
+            coordinates.
+        """
+        axis, rotation = self._standard_rotation()
+        natom = len(atoms_coords)
+        if out is None:
+            out = np.empty((natom, 3), dtype=float)
+        lower = np.full((3, ), np.inf)
+        upper = np.full((3, ), -np.inf)
+        for start in range(0, natom, chunksize):
+            end = min(start + chunksize, natom)
+            coords = np.array(atoms_coords[start:end], dtype=float)
+            if self.period_type != "0D":
+                cells = self.cell.cells(coords,
+                                        nc.RELATIVE_PERIODIC_TOLERANCE)
+                if rotation is not None:
+                    coords = np.dot(coords, rotation)
+                coords -= np.dot(cells, axis)
+            out[start:end] = coords
+            if recenter:
+                lower = np.minimum(lower, np.min(coords, axis=0))
+                upper = np.maximum(upper, np.max(coords, axis=0))
+        if recenter and natom:
+            shift = np.zeros((3, ), dtype=float)
+            nonperiodic = NONPERIODIC_DIRECTIONS[self.period_type]
+            shift[nonperiodic] = (lower[nonperiodic]
+                                  + upper[nonperiodic]) / 2.0
+            if np.any(shift):
+                for start in range(0, natom, chunksize):
+                    end = min(start + chunksize, natom)
+                    out[start:end] -= shift
+        return axis, out
+
+
+    def _standard_rotation(self):
+        """Returns the rotation of the structure into standard form.
+        
+        Returns:
+            Translational vectors in standard form and the rotation matrix (to
+            be multiplied from the right) or None, if no rotation is needed
+            (see rotate_coordsys()).
+        """
+        if self._standard is not None:
+            return self._standard
         if self.period_type == "0D":
-            return [], atoms_coords
+            self._standard = ( [], None )
+            return self._standard
         elif self.period_type == "1D":
             z_axis = self.axis_cart[0]
         elif self.period_type == "2D":
             z_axis = np.cross(self.axis_cart[0], self.axis_cart[1])
         elif self.period_type == "3D":
-            return self.axis_cart, atoms_coords            
+            self._standard = ( self.axis_cart, None )
+            return self._standard
 
         # Calculate rotation angle and rotation axis
         z_axis= z_axis / np.linalg.norm(z_axis)
@@ -181,11 +585,8 @@ class Periodicity:
                              [ 0.0, 0.0, 1.0 ]], dtype=float)
             axis = np.dot(axis, rot2)
             rotation_matrix = np.dot(rotation_matrix, rot2)
-        
-        # Rotate atoms
-        atoms_coords = np.dot(atoms_coords, rotation_matrix)
-        
-        return axis, atoms_coords
+        self._standard = ( axis, rotation_matrix )
+        return self._standard
 
 
     def get_axis(self, coordsys="lattice"):
@@ -224,27 +625,14 @@ class Periodicity:
         coords = np.array(coords)
         if self.period_type == "0D":
             return np.empty(( len(coords), 0 ), dtype=float), coords
-        elif self.period_type == "1D":
-            axis_norm = np.linalg.norm(self.axis_cart[0])
-            relcoords = np.dot(coords, np.transpose(self.axis_cart[0])) 
-            relcoords /= axis_norm**2
-            relcoords.shape = (len(relcoords), 1)
-        elif self.period_type == "2D":
-            axis_3D = np.array(
-                [ self.axis_cart[0], self.axis_cart[1],
-                np.cross(self.axis_cart[0], self.axis_cart[1]) ])
-            invbasis = np.linalg.inv(axis_3D)
-            relcoords = np.dot(coords, invbasis)[:,0:2]
-        elif self.period_type == "3D":
-            invbasis = np.linalg.inv(self.axis_cart)
-            relcoords = np.dot(coords, invbasis)
-        shifts = coords - np.dot(relcoords, self.axis_cart)
+        relcoords = self.cell.to_relative(coords)
+        shifts = coords - self.cell.to_cartesian(relcoords)
         return relcoords, shifts
-        
+
 
     def fold_to_unitcell(self, atoms_coords):
         """Folds atoms in the central unit cell, with relative coordinates
-        between 0.0 and 1.0.
+        between 0.0 and 1.0 (see standardize_coords() for the boundaries).
         
         Args:
             atoms_coords: Cartesian coordinates of the atoms. 
@@ -252,21 +640,23 @@ class Periodicity:
         Returns:
             Cartesian coordinates of the atoms in the unit cell.
         """
-        atoms_coords = np.array(atoms_coords)
+        atoms_coords = np.array(atoms_coords, dtype=float)
         if self.period_type == "0D":
             return atoms_coords
-        relcoords, shifts = self.splitcoords(atoms_coords)        
-        relcoords_folded = relcoords % 1.0
-        atoms_coords = shifts + np.dot(relcoords_folded, self.axis_cart)  
-        return atoms_coords
+        return self.cell.fold(atoms_coords, nc.RELATIVE_PERIODIC_TOLERANCE,
+                              out=atoms_coords)
 
 
-    def mask_unique(self, coords, mask=None):
+    def mask_unique(self, coords, mask=None, seen=None):
         """Masks points being unique in the unit cell.
         
         Args:
             coords: Cartesian coordinates of the points (atoms).
             mask: Only those coordinates are considered, where mask is True
+            seen: List with the unique boundary points of previous calls or
+                None. If given, points equivalent to one of them are masked
+                out and the unique boundary points of the current call are
+                appended to it. (Allows to process the points block by block.)
             
         Returns:
            Logical list containing True for unique atoms and False otherwise.
@@ -283,17 +673,202 @@ class Periodicity:
             relcoords - 1.0, relcoords)
         onbounds = np.flatnonzero(np.any(np.less(relcoords, 0.01), axis=1))
         onbounds_rel = relcoords[onbounds]
-        onbounds_cart = np.dot(onbounds_rel, self.axis_cart) + shifts[onbounds]
-        for ii in range(len(onbounds_cart)):
-            if not unique[onbounds[ii]]:
-                continue
-            diff = onbounds_cart[ii+1:] - onbounds_cart[ii]
-            equiv = np.flatnonzero(np.less(np.sum(diff**2, axis=1),
-                                           nc.DISTANCE_TOLERANCE**2))
-            unique[onbounds[equiv + ii + 1]] = False
+        onbounds_cart = self.cell.to_cartesian(onbounds_rel) + shifts[onbounds]
+        
+        # Points of previous calls come first, they are unique by definition.
+        if seen:
+            seen_cart = np.vstack(seen)
+            if len(onbounds_cart):
+                # Only points close to the current ones may be equivalent
+                near = np.all(np.logical_and(
+                    seen_cart >= (onbounds_cart.min(axis=0)
+                                  - nc.DISTANCE_TOLERANCE),
+                    seen_cart <= (onbounds_cart.max(axis=0)
+                                  + nc.DISTANCE_TOLERANCE)), axis=1)
+                seen_cart = seen_cart[near]
+        else:
+            seen_cart = np.empty((0, 3), dtype=float)
+        nseen = len(seen_cart)
+        points = np.vstack(( seen_cart, onbounds_cart ))
+        considered = np.concatenate(( np.ones((nseen, ), dtype=bool),
+                                      unique[onbounds] ))
+        first, second = close_pairs(points, nc.DISTANCE_TOLERANCE)
+        relevant = np.logical_and(considered[first], considered[second])
+        relevant = np.logical_and(relevant, second >= nseen)
+        first, second = first[relevant], second[relevant]
+        
+        # A point is unique if no earlier unique point is equivalent to it.
+        # (Iterate, as a point masked out by an earlier one does not mask out
+        # further points.)
+        kept = considered.copy()
+        while True:
+            masked = np.zeros((len(points), ), dtype=bool)
+            masked[second[kept[first]]] = True
+            newkept = np.logical_and(considered, np.logical_not(masked))
+            if np.array_equal(newkept, kept):
+                break
+            kept = newkept
+        unique[onbounds] = kept[nseen:]
+        if seen is not None:
+            seen.append(onbounds_cart[unique[onbounds]])
         return unique
 
 
+    def iter_atoms_in_cell(self, geometry, body,
+                           chunksize=nc.DEFAULT_CHUNK_SIZE):
+        """Generates the atoms of a periodic body without duplicates.
+        
+        The lattice points of the primitive cell are enumerated exactly as the
+        representatives of the cosets of the superlattice spanned by its axis,
+        which follow from the Hermite normal form of the axis. Along the
+        non-periodic directions, the lattice points of the containing cuboid
+        of the body are enumerated and the atoms are clipped by the shape of
+        the body. The atoms of the primitive cell are then translated to
+        build the repeated cell. If several periodic images of an atom are
+        inside the shape, the one at the first lattice point of the lattice
+        grid is taken, as done by mask_unique() when the grid is filtered. The
+        atoms are delivered in the order of the lattice grid.
+        
+        As the periodic images are selected and the atoms are sorted over the
+        whole repeated cell, all atoms are collected before the first block is
+        delivered. The memory needed is therefore proportional to the number of
+        atoms in the result (also if the result is stored in a scratch
+        directory), and the enumeration can not be split among worker
+        processes (select_atoms() uses a single process for it).
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            body: Periodic body with this periodicity.
+            chunksize: Maximal number of lattice points per block.
+            
+        Yields:
+            Coordinates and type indices of the next block of atoms inside.
+        """
+        nperiodic = len(self.axis)
+        primitive = self.enum_axis // self.repetition[:,np.newaxis]
+        hnf, basis = hermite_normal_form(primitive)
+        cellvecs = np.dot(basis, geometry.latvecs)
+        # Lattice points, for which an atom may be in the containing cuboid
+        cuboid = body.containing_cuboid()
+        corners = np.array([ cuboid[ind, range(3)] for ind
+                             in itertools.product((0, 1), repeat=3) ])
+        corners = (corners[:,np.newaxis,:] - geometry.basis).reshape(-1, 3)
+        relcorners = LatticeTransforms(cellvecs).to_relative(corners)
+        lower = np.floor(relcorners.min(axis=0)).astype(int)
+        upper = np.ceil(relcorners.max(axis=0)).astype(int)
+        lower[:nperiodic] = 0
+        upper[:nperiodic] = np.diag(hnf) - 1
+        shape = upper - lower + 1
+        npoint = int(np.prod(shape))
+        printstatus("Number of enumerated lattice points: {:d}".format(npoint),
+                    indentlevel=1)
+        atoms_cells = [ np.empty((0, 3), dtype=int) ]
+        atoms_idx = [ np.empty((0, ), dtype=int) ]
+        relcoords = [ np.empty((0, nperiodic), dtype=float) ]
+        for start in range(0, npoint, chunksize):
+            cells = np.column_stack(np.unravel_index(
+                np.arange(start, min(start + chunksize, npoint)), shape))
+            block = self._fold_into_primitive_cell(
+                geometry, body, primitive, np.dot(cells + lower, basis))
+            atoms_cells.append(block[0])
+            atoms_idx.append(block[1])
+            relcoords.append(block[2])
+        atoms_cells = np.vstack(atoms_cells)
+        atoms_idx = np.concatenate(atoms_idx)
+        relcoords = np.vstack(relcoords)
+        
+        # Translate the primitive cell to all positions in the repeated cell
+        tiles = np.array(list(itertools.product(
+            *[ range(nrep) for nrep in self.repetition ])), dtype=int)
+        natom = len(atoms_idx)
+        atoms_cells = (atoms_cells[np.newaxis,:,:]
+                       + np.dot(tiles, primitive)[:,np.newaxis,:]
+                       ).reshape(-1, 3)
+        relcoords = ((relcoords[np.newaxis,:,:] + tiles[:,np.newaxis,:])
+                     / self.repetition).reshape(-1, nperiodic)
+        atoms_idx = np.tile(atoms_idx, len(tiles))
+        printstatus("Atoms in primitive cell: {:d}, repetitions: {:d}"
+                    .format(natom, len(tiles)), indentlevel=1)
+        self._select_first_images(geometry, body, atoms_cells, atoms_idx,
+                                  relcoords)
+        
+        order = _lattice_order(atoms_cells, atoms_idx, len(geometry.basis))
+        step = chunksize * len(geometry.basis)
+        for start in range(0, len(order), step):
+            chunk = order[start:start + step]
+            # Positions calculated as in the lattice grid for identical results
+            yield (np.dot(atoms_cells[chunk], geometry.latvecs)
+                   + geometry.basis[atoms_idx[chunk]]), atoms_idx[chunk]
+
+
+    def _fold_into_primitive_cell(self, geometry, body, primitive, cells):
+        """Folds the atoms of lattice cells into the primitive cell of a body.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            body: Periodic body with this periodicity.
+            primitive: Axis of the primitive cell in lattice coordinates.
+            cells: Lattice indices of the cells.
+            
+        Returns:
+            Lattice indices of the cells, type indices and coordinates relative
+            to the primitive axis of the folded atoms inside the shape.
+        """
+        # The representatives may be far away from the cell. Move them close
+        # to it with integer translations first to avoid rounding errors.
+        relcoords = (self.splitcoords(np.dot(cells, geometry.latvecs))[0]
+                     * self.repetition)
+        cells = cells - np.dot(np.round(relcoords).astype(int), primitive)
+        atoms_coords, atoms_idx = geometry.gen_atoms(
+            np.dot(cells, geometry.latvecs))
+        cells = np.repeat(cells, len(geometry.basis), axis=0)
+        relcoords = (self.splitcoords(atoms_coords - body.shift_vector)[0]
+                     * self.repetition)
+        shifts = np.floor(relcoords).astype(int)
+        relcoords -= shifts
+        cells -= np.dot(shifts, primitive)
+        atoms_coords -= np.dot(shifts, np.dot(primitive, geometry.latvecs))
+        inside = body.atoms_in_shape(atoms_coords)
+        return cells[inside], atoms_idx[inside], relcoords[inside]
+
+
+    def _select_first_images(self, geometry, body, cells, atoms_idx,
+                             relcoords):
+        """Replaces atoms at the faces of the cell by their first image.
+        
+        Args:
+            geometry: Geometry of the base crystal.
+            body: Periodic body with this periodicity.
+            cells: Lattice indices of the cells of the atoms inside the cell.
+                Changed in place to the cell of the periodic image inside the
+                shape with the smallest lattice indices (lexicographic order).
+            atoms_idx: Type indices of the atoms.
+            relcoords: Coordinates of the atoms relative to the axis.
+        """
+        upper = relcoords > 1.0 - nc.RELATIVE_PERIODIC_TOLERANCE
+        lower = relcoords < nc.RELATIVE_PERIODIC_TOLERANCE
+        onfaces = np.flatnonzero(np.any(np.logical_or(upper, lower), axis=1))
+        upper = upper[onfaces]
+        lower = lower[onfaces]
+        best_cells = cells[onfaces]
+        for offset in itertools.product((-1, 0, 1), repeat=len(self.axis)):
+            offset = np.array(offset, dtype=int)
+            if not np.any(offset):
+                continue
+            near = np.flatnonzero(np.all(
+                (offset == 0) | ((offset < 0) & upper) | ((offset > 0) & lower),
+                axis=1))
+            image_cells = (cells[onfaces[near]]
+                           + np.dot(offset, self.enum_axis))
+            inimage = body.atoms_in_shape(
+                np.dot(image_cells, geometry.latvecs)
+                + geometry.basis[atoms_idx[onfaces[near]]])
+            better = np.logical_and(inimage,
+                                    _lexless(image_cells, best_cells[near]))
+            best_cells[near[better]] = image_cells[better]
+        cells[onfaces] = best_cells
+
+
     @classmethod
     def fromdict(cls, geometry, inidict):
         """Builds instance from dictionary."""
@@ -306,6 +881,9 @@ class Periodicity:
         if period_type == "0D":
             return cls(geometry, "0D")
 
+        # Only possible for 3D periodicity (see below)
+        target_atoms = None
+
         # 1D periodicity        
         if period_type == "1D":
             axis = inidict.get("axis", None)
@@ -353,13 +931,37 @@ class Periodicity:
         else:
             axis = inidict.get("axis", None)
             superlattice = inidict.get("superlattice", None)
-            if axis is None and superlattice is None:
-                error("Either 'axis' or 'superlattice' needed for "
-                      "periodicity specification.")
-            elif axis is not None and superlattice is not None:
-                error("Only one of the keywords 'axis' or 'superlattice'"
-                      "can be used for periodicity specification.")                
-            if superlattice:
+            target_atoms = inidict.get("target_atoms", None)
+            nspec = sum(spec is not None
+                        for spec in ( axis, superlattice, target_atoms ))
+            if nspec == 0:
+                error("Either 'axis', 'superlattice' or 'target_atoms' needed "
+                      "for periodicity specification.")
+            elif nspec > 1:
+                error("Only one of the keywords 'axis', 'superlattice' or "
+                      "'target_atoms' can be used for periodicity "
+                      "specification.")
+            if target_atoms:
+                try:
+                    target_atoms = int(target_atoms)
+                except ValueError:
+                    error("Invalid target_atoms specification")
+                ncell = int(round(target_atoms / len(geometry.basis)))
+                if ncell < 1:
+                    error("Target number of atoms smaller than the basis")
+                shape = inidict.get("supercell_shape", "cubic")
+                if shape not in [ "cubic", "isotropic" ]:
+                    error("Invalid supercell_shape '" + shape + "'")
+                printstatus("Searching {} supercell with about {:d} atoms "
+                            "({:d} primitive cells)".format(
+                                shape, target_atoms, ncell))
+                axis = search_supercell(geometry.input_latvecs, ncell, shape)
+                if axis is None:
+                    error("No supercell found with the requested size")
+                printstatus("Found supercell with {:d} atoms".format(
+                    int(round(abs(np.linalg.det(axis))))
+                    * len(geometry.basis)), indentlevel=1)
+            elif superlattice:
                 try:
                     superlattice = np.array([ float(s) 
                                              for s in superlattice.split() ])
@@ -369,7 +971,7 @@ class Periodicity:
                 if np.abs(np.linalg.det(superlattice)) < nc.EPSILON:
                     error("Linearly dependent superlattice vectors")
                 axis = cell_axis_from_superlattice(superlattice,
-                    np.dot(geometry.bravais_cell, geometry.latvecs))
+                                                   geometry.bravais_lattice)
             else: 
                 try:
                     axis = np.array([ int(s) for s in axis.split() ])
@@ -381,34 +983,56 @@ class Periodicity:
                 if np.abs(np.linalg.det(axis)) < nc.EPSILON:
                     error("Linearly dependent axis")
 
-        # Switch back to primitive lattice, if necessary                    
-        if np.any(geometry.bravais_cell != np.eye(3, dtype=int)):
+        # Switch back to primitive lattice, if necessary (searched supercells
+        # are built from the primitive lattice directly)
+        if (not target_atoms
+            and np.any(geometry.bravais_cell != np.eye(3, dtype=int))):
             printstatus("Axis with respect to Bravais lattice:")
             for vec in axis:
                 printstatus("{:3d} {:3d} {:3d}".format(
                     *[ int(ss) for ss in vec ]), indentlevel=1)
             axis = np.dot(axis, geometry.bravais_cell)
             
-        # Get smallest possible unit cell
-        for ii in range(len(axis)):
-            divisor = gcd(abs(axis[ii]))
-            axis[ii] = axis[ii] // divisor
+        # Get smallest possible unit cell (searched supercells have the
+        # requested size already)
+        if not target_atoms:
+            for ii in range(len(axis)):
+                divisor = gcd(abs(axis[ii]))
+                axis[ii] = axis[ii] // divisor
                     
         printstatus("Axis with respect to primitive lattice:")
         for vec in axis:
             printstatus("{:3d} {:3d} {:3d}".format(
                 *[ int(ss) for ss in vec ]), indentlevel=1)
+        
+        # Reduce unit cell to shortest and most orthogonal axis
+        try:
+            reduce = inidict.getboolean("reduce_axis", fallback=False)
+        except ValueError:
+            error("Invalid value for reduce_axis.")
+        if reduce and len(axis) > 1:
+            oldratio = cell_aspect_ratio(np.dot(axis, geometry.input_latvecs))
+            axis = reduce_axis(axis, geometry.input_latvecs)
+            newratio = cell_aspect_ratio(np.dot(axis, geometry.input_latvecs))
+            printstatus("Aspect ratio of the cell: {:.3f} (before reduction:"
+                        " {:.3f})".format(newratio, oldratio))
+            printstatus("Reduced axis with respect to primitive lattice:")
+            for vec in axis:
+                printstatus("{:3d} {:3d} {:3d}".format(
+                    *[ int(ss) for ss in vec ]), indentlevel=1)
                 
         # Repeat unit cell
         cellrep = inidict.get("axis_repetition", None)
         if cellrep:
             try:
-                cellrep = np.array([ float(s) for s in cellrep.split() ])
+                cellrep = np.array([ int(s) for s in cellrep.split() ])
                 cellrep.shape = (int(period_type[0]), )
             except ValueError:
                 error("Invalid axis repetition specification.")
+            if np.any(cellrep < 1):
+                error("Axis repetitions must be positive.")
             axis = np.array(axis * cellrep[:,np.newaxis], int)
             printstatus("Axis repetition:"
-                + " ".join([ "{:3d}".format(int(s)) for s in cellrep ]))
+                + " ".join([ "{:3d}".format(s) for s in cellrep ]))
 
-        return cls(geometry, period_type, axis)
+        return cls(geometry, period_type, axis, cellrep)
@@ -1,7 +1,10 @@
 import numpy as np
-from .body import Body
-from nanocut.common import EPSILON
+from .body import Body, BLOCK_INSIDE, BLOCK_OUTSIDE, BLOCK_BOUNDARY
+from nanocut.common import EPSILON, INTERVAL_TOLERANCE, CULLING_TOLERANCE
+from nanocut.common import DISTANCE_TOLERANCE, HULL_TOLERANCE, HULL_JOGGLE
+from nanocut.common import HULL_HEIGHT_RATIO
 from nanocut.output import error
+from nanocut.periodicity import close_pairs
 
 
 class Polyhedron(Body):
@@ -14,6 +17,8 @@ class Polyhedron(Body):
                  "planes_miller": ( "floatarray", (-1,4), True, False ),    
     }
     
+    exact_enumeration = True
+    
     def __init__(self, geometry, period, **kwargs):
         """Constructs Polyhedron instance.
         
@@ -31,45 +36,18 @@ class Polyhedron(Body):
 
         # Remove identical planes (identical = parallel, but not antiparallel,
         # with similar distance from origin)
-        unique = np.ones(( len(planes_normal), ), dtype=bool)
-        for i1 in range(len(planes_normal)):
-            if not unique[i1]:
-                continue
-            for i2 in range(i1 + 1, len(planes_normal)):
-                if not unique[i2]:
-                    continue
-                ddiff = planes_normal[i1, 3] - planes_normal[i2, 3]
-                cross = np.cross(planes_normal[i1, 0:3], planes_normal[i2, 0:3])
-                vsum = planes_normal[i1, 0:3] + planes_normal[i2, 0:3]
-                unique[i2] = (abs(ddiff) > EPSILON 
-                              or np.any(abs(cross)) > EPSILON
-                              or np.all(abs(vsum) < EPSILON))
-        self.planes_normal = planes_normal[unique]
-
-        # Solve a linear equation for each triplet of planes returning their
-        # vertex, ignore parallel planes
-        self.corners = []
-        for i1 in range(0, len(self.planes_normal)):
-            for i2 in range(i1 + 1, len(self.planes_normal)):
-                for i3 in range(i2 + 1, len(self.planes_normal)):
-                    coeffs = np.vstack((
-                                        self.planes_normal[i1, 0:3],
-                                        self.planes_normal[i2, 0:3],
-                                        self.planes_normal[i3, 0:3] ))
-                    det = np.linalg.det(coeffs)
-                    if abs(det) < EPSILON:
-                        continue
-                    rhs = np.vstack((
-                                     self.planes_normal[i1, 3],
-                                     self.planes_normal[i2, 3],
-                                     self.planes_normal[i3, 3] ))
-                    corner = np.dot(np.linalg.inv(coeffs), rhs)
-                    self.corners.append(corner.flatten())
-        self.corners = np.array(self.corners)
-        
-        if np.all(len(self.corners) < 6 or abs(self.corners) < EPSILON):
-            exit('Error:\nNo or insufficient corners found.\nExiting...\n')
+        self.planes_normal = unique_planes(planes_normal)
+
+        # Determine the vertices of the body and the planes forming its faces
+        self.planes_normal, self.corners = halfspace_intersection(
+            self.planes_normal)
+        if len(self.corners) < 4:
+            error("No or insufficient corners found.")
         self.corners += self.shift_vector
+        
+        # Order in which atoms_in_shape() tests the planes (set by the first
+        # call).
+        self._plane_order = None
 
 
     @staticmethod
@@ -79,8 +57,7 @@ class Polyhedron(Body):
         if miller_defs is not None:
             if np.any(np.all(abs(miller_defs[:,0:3]) < EPSILON, axis=1)):
                 error("Emtpy miller index tuple")
-            miller_defs[:,0:3] = miller_to_normal(
-                np.dot(geometry.latvecs, geometry.bravais_cell),
+            miller_defs[:,0:3] = geometry.bravais_lattice.miller_to_normal(
                 miller_defs[:,0:3])
         else:
             miller_defs = np.zeros((0, 4), dtype=float)
@@ -107,8 +84,15 @@ class Polyhedron(Body):
                            self.corners.max(axis=0) ))
 
           
-    def atoms_inside(self, atoms):
-        """Decides which atoms are inside the body (see Body class)."""
+    def atoms_in_shape(self, atoms):
+        """Decides which atoms are inside the shape (see Body class).
+        
+        The planes are applied in blocks of doubling size, each block only to
+        the atoms not rejected by the previous ones. The order of the planes
+        is learned in the first call: the planes rejecting the most atoms are
+        tested first. The mask does not depend on the order, as the distances
+        from the planes are calculated elementwise.
+        """
         # An atom is inside, if projections along all plane normals have the
         # same sign as an arbitrary point (center of mass) in the polyhedron. 
         point_inside = (np.sum(self.corners, axis=0) / float(len(self.corners))
@@ -116,23 +100,448 @@ class Polyhedron(Body):
         atoms_relative = atoms[:,:3] - self.shift_vector
         normvecs = np.transpose(self.planes_normal[:,0:3])
         normdists = self.planes_normal[:,3]
-        sign_point = (normdists - np.dot(point_inside, normvecs) <= 0.0)
-        sign_atoms = (normdists - np.dot(atoms_relative, normvecs) <= 0.0)
-        compared = (sign_atoms == sign_point)
-        atoms_inside_body = np.all(compared, axis=1)
+        sign_point = (normdists - _projections(point_inside[np.newaxis,:],
+                                               normvecs)[0] <= 0.0)
+        if self._plane_order is None:
+            sign_atoms = (normdists - _projections(atoms_relative, normvecs)
+                          <= 0.0)
+            compared = (sign_atoms == sign_point)
+            if len(atoms):
+                rejected = len(atoms) - np.sum(compared, axis=0)
+                self._plane_order = np.argsort(-rejected, kind="stable")
+            return np.all(compared, axis=1)
+        candidates = np.arange(len(atoms))
+        start = 0
+        blocksize = 1
+        while start < len(self._plane_order) and len(candidates):
+            planes = self._plane_order[start:start + blocksize]
+            sign_atoms = (normdists[planes]
+                          - _projections(atoms_relative, normvecs[:,planes])
+                          <= 0.0)
+            kept = np.all(sign_atoms == sign_point[planes], axis=1)
+            if not np.all(kept):
+                candidates = candidates[kept]
+                atoms_relative = atoms_relative[kept]
+            start += blocksize
+            blocksize *= 2
+        atoms_inside_body = np.zeros((len(atoms), ), dtype=bool)
+        atoms_inside_body[candidates] = True
         return atoms_inside_body
 
 
-def miller_to_normal(latvecs, miller_indices):
-    """Calculates the normal form of a plane defined by Miller indices.
+    def oriented_planes(self):
+        """Returns the planes with normal vectors pointing outwards.
+        
+        Returns:
+            Normal vectors and distances of the planes, oriented such that
+            normal . (atom - shift_vector) <= distance for atoms inside, with
+            the same sign convention as in atoms_in_shape().
+        """
+        point_inside = (np.sum(self.corners, axis=0) / float(len(self.corners))
+                        - self.shift_vector)
+        normvecs = self.planes_normal[:,0:3]
+        normdists = self.planes_normal[:,3]
+        sign_point = (normdists - np.dot(normvecs, point_inside) <= 0.0)
+        flip = np.where(sign_point, -1.0, 1.0)
+        return normvecs * flip[:,np.newaxis], normdists * flip
+
+
+    def classify_blocks(self, corners):
+        """Classifies convex blocks with respect to the body (see Body
+        class)."""
+        normvecs, normdists = self.oriented_planes()
+        room = normdists - np.dot(corners - self.shift_vector,
+                                  normvecs.transpose())
+        inside = np.all(np.all(room >= CULLING_TOLERANCE, axis=2), axis=1)
+        outside = np.any(np.all(room < -CULLING_TOLERANCE, axis=1), axis=1)
+        return np.where(inside, BLOCK_INSIDE,
+                        np.where(outside, BLOCK_OUTSIDE, BLOCK_BOUNDARY))
+
+
+    def row_intervals(self, geometry, rows):
+        """Determines the atoms inside the body along lattice rows (see Body
+        class)."""
+        normvecs, normdists = self.oriented_planes()
+
+        # Each plane bounds k from one side, planes parallel to the rows either
+        # accept or reject the entire row.
+        slopes = np.dot(normvecs, geometry.latvecs[2])
+        parallel = np.abs(slopes) < EPSILON
+        upper_bounding = np.logical_and(np.logical_not(parallel), slopes > 0.0)
+        lower_bounding = np.logical_and(np.logical_not(parallel), slopes < 0.0)
+        origins = np.dot(rows, geometry.latvecs[0:2]) - self.shift_vector
+        nbasis = len(geometry.basis)
+        lower = np.empty((len(rows), nbasis), dtype=float)
+        upper = np.empty((len(rows), nbasis), dtype=float)
+        ambiguous = np.empty((len(rows), nbasis), dtype=bool)
+        for ib, basisvec in enumerate(geometry.basis):
+            room = normdists - np.dot(origins + basisvec, normvecs.transpose())
+            bounds = room / np.where(parallel, 1.0, slopes)
+            upper[:,ib] = np.min(bounds[:,upper_bounding], axis=1,
+                                 initial=np.inf)
+            lower[:,ib] = np.max(bounds[:,lower_bounding], axis=1,
+                                 initial=-np.inf)
+            room = room[:,parallel]
+            outside = np.any(room < -INTERVAL_TOLERANCE, axis=1)
+            lower[outside,ib] = np.inf
+            upper[outside,ib] = -np.inf
+            ambiguous[:,ib] = np.any(np.abs(room) <= INTERVAL_TOLERANCE,
+                                     axis=1)
+        return lower, upper, ambiguous
+
+
+def _projections(points, normvecs):
+    """Returns np.dot(points, normvecs) calculated elementwise.
+    
+    The rounding of np.dot() depends on the shapes of the arrays, the
+    result of this function does not.
+    """
+    return (points[:,0,np.newaxis] * normvecs[0]
+            + points[:,1,np.newaxis] * normvecs[1]
+            + points[:,2,np.newaxis] * normvecs[2])
+
+
+def unique_planes(planes_normal):
+    """Removes identical planes.
+    
+    Args:
+        planes_normal: Normalized normal vectors and distances of the planes.
+    
+    Returns:
+        First occurrence of each plane, in the original order. Antiparallel
+        planes are kept.
+    """
+    keys = np.round(planes_normal / DISTANCE_TOLERANCE).astype(np.int64)
+    dummy, first = np.unique(keys, axis=0, return_index=True)
+    return planes_normal[np.sort(first)]
+
+
+def halfspace_intersection(planes_normal):
+    """Determines the vertices and the faces of a polyhedron.
+    
+    The polyhedron is the region of the plane arrangement containing the
+    origin. Its vertices are obtained from the convex hull of the dual points
+    (normal vector divided by distance) of the planes with respect to a point
+    well inside the region. If the origin lies on one of the planes or its
+    region is unbounded (the planes do not enclose the origin), the region
+    containing the center of all intersection points of plane triples is
+    taken instead. Planes which do not contain a face (because they only
+    touch the polyhedron in a vertex or an edge or not at all) are dropped.
+    
+    Args:
+        planes_normal: Normalized normal vectors and distances of the planes.
+    
+    Returns:
+        Planes forming a face of the polyhedron and its distinct vertices.
+    """
+    center = None
+    if np.all(np.abs(planes_normal[:,3]) > EPSILON):
+        center = _interior_point(planes_normal)
+        # A hull around the center implies a bounded region
+        intersections = _hull_vertices(planes_normal, center)
+        if intersections is None:
+            if _region_bounded(planes_normal, center):
+                intersections = _all_intersections(planes_normal, center)
+            else:
+                center = None
+    if center is None:
+        center = _intersections_center(planes_normal)
+        intersections = _all_intersections(planes_normal, center)
+    room = _oriented_room(planes_normal, intersections, center)
+    feasible = np.all(room >= -DISTANCE_TOLERANCE, axis=1)
+    vertices = intersections[feasible]
+    room = room[feasible]
+    
+    # Merge vertices shared by more than three planes
+    first, second = close_pairs(vertices, DISTANCE_TOLERANCE)
+    distinct = np.ones((len(vertices), ), dtype=bool)
+    distinct[second] = False
+    vertices = vertices[distinct]
+    onplane = np.abs(room[distinct]) <= DISTANCE_TOLERANCE
+    
+    # A plane forms a face, if its vertices are not all on a line
+    face = np.zeros((len(planes_normal), ), dtype=bool)
+    for iplane in np.flatnonzero(np.sum(onplane, axis=0) >= 3):
+        points = vertices[onplane[:,iplane]]
+        face[iplane] = (np.linalg.matrix_rank(
+            points[1:] - points[0], tol=DISTANCE_TOLERANCE) == 2)
+    return planes_normal[face], vertices
+
+
+def plane_intersections(planes_normal, triples):
+    """Calculates the intersection points of plane triples.
     
     Args:
-       latvecs: Lattice vectors.
-       miller_indices: Miller indices.
-       
+        planes_normal: Normal vectors and distances of the planes.
+        triples: Indices of the planes in each triple as (-1, 3) array.
+    
     Returns:
-        Cartesian normal vector(s) of the plane(s).
+        Intersection points of the triples, triples containing parallel planes
+        are left out.
     """
-    invlatvecs = np.linalg.inv(latvecs)
-    normals = np.dot(miller_indices, invlatvecs)
-    return normals
+    n1 = planes_normal[triples[:,0],0:3]
+    n2 = planes_normal[triples[:,1],0:3]
+    n3 = planes_normal[triples[:,2],0:3]
+    cross23 = np.cross(n2, n3)
+    dets = np.sum(n1 * cross23, axis=1)
+    valid = np.abs(dets) >= EPSILON
+    points = (planes_normal[triples[:,0],3,np.newaxis] * cross23
+              + planes_normal[triples[:,1],3,np.newaxis] * np.cross(n3, n1)
+              + planes_normal[triples[:,2],3,np.newaxis] * np.cross(n1, n2))
+    return points[valid] / dets[valid,np.newaxis]
+
+
+def _oriented_room(planes_normal, points, center):
+    """Returns the distances of points from the planes, being positive on the
+    side of the center."""
+    normvecs = planes_normal[:,0:3]
+    normdists = planes_normal[:,3]
+    flip = np.where(normdists - np.dot(normvecs, center) <= 0.0, -1.0, 1.0)
+    return (normdists - np.dot(points, normvecs.transpose())) * flip
+
+
+def _interior_point(planes_normal):
+    """Returns a point in the region of the origin, which is not much closer
+    to any of the planes than to the farthest one."""
+    center = np.zeros((3, ), dtype=float)
+    outwards = planes_normal[:,0:3] * np.sign(planes_normal[:,3])[:,np.newaxis]
+    distances = np.abs(planes_normal[:,3])
+    for iteration in range(3):
+        heights = distances - np.dot(outwards, center)
+        close = heights < HULL_HEIGHT_RATIO * np.max(heights)
+        direction = -np.sum(outwards[close], axis=0)
+        norm = np.linalg.norm(direction)
+        if norm < EPSILON:
+            break
+        direction /= norm
+        # Go half way towards the first plane in that direction
+        rates = np.dot(outwards, direction)
+        approaching = rates > EPSILON
+        if not np.any(approaching):
+            break
+        center += 0.5 * np.min(heights[approaching]
+                               / rates[approaching]) * direction
+    return center
+
+
+def _region_bounded(planes_normal, center):
+    """Decides whether the region of the plane arrangement containing the
+    center is bounded, which is the case if the outwards pointing normal
+    vectors of the planes surround the origin."""
+    if len(planes_normal) < 4:
+        return False
+    heights = planes_normal[:,3] - np.dot(planes_normal[:,0:3], center)
+    outwards = planes_normal[:,0:3] * np.sign(heights)[:,np.newaxis]
+    return convex_hull(outwards, np.zeros((3, ), dtype=float)) is not None
+
+
+def _hull_vertices(planes_normal, center):
+    """Returns the intersection points of the plane triples forming the
+    vertices of the region containing the center or None, if the convex hull
+    of the dual points failed (e.g. because the region is unbounded) or the
+    center is too close to one of the planes (e.g. in very skewed regions)."""
+    if len(planes_normal) < 4:
+        return None
+    heights = planes_normal[:,3] - np.dot(planes_normal[:,0:3], center)
+    # Dual points differing by many orders of magnitude spoil the hull
+    if (np.min(np.abs(heights))
+            < HULL_HEIGHT_RATIO * np.max(np.abs(heights))):
+        return None
+    dual = planes_normal[:,0:3] / heights[:,np.newaxis]
+    facets = convex_hull(dual, np.zeros((3, ), dtype=float))
+    if facets is None:
+        return None
+    return plane_intersections(planes_normal, facets)
+
+
+def _iter_triples(nplane):
+    """Generates all plane triples in blocks (one block per first plane)."""
+    for i1 in range(nplane - 2):
+        i2, i3 = np.triu_indices(nplane - i1 - 1, 1)
+        yield np.column_stack(( np.full(i2.shape, i1), i2 + i1 + 1,
+                                i3 + i1 + 1 ))
+
+
+def _intersections_center(planes_normal):
+    """Returns the center of the intersection points of all plane triples."""
+    total = np.zeros((3, ), dtype=float)
+    npoint = 0
+    for triples in _iter_triples(len(planes_normal)):
+        points = plane_intersections(planes_normal, triples)
+        total += np.sum(points, axis=0)
+        npoint += len(points)
+    return total / max(npoint, 1)
+
+
+def _all_intersections(planes_normal, center):
+    """Returns the intersection points of all plane triples, which are not
+    outside of the region containing the center."""
+    intersections = [ np.empty((0, 3), dtype=float) ]
+    for triples in _iter_triples(len(planes_normal)):
+        points = plane_intersections(planes_normal, triples)
+        room = _oriented_room(planes_normal, points, center)
+        intersections.append(
+            points[np.all(room >= -DISTANCE_TOLERANCE, axis=1)])
+    return np.vstack(intersections)
+
+
+def convex_hull(points, interior):
+    """Determines the convex hull of points via the quickhull algorithm.
+    
+    The points are joggled by a tiny deterministic amount first, so that
+    coplanar points (e.g. the dual points of planes meeting in one vertex)
+    can not produce degenerate faces. Faces lying in the same plane are
+    therefore returned as several triangles.
+    
+    Args:
+        points: Cartesian coordinates of the points.
+        interior: Point which must be strictly inside the hull.
+        
+    Returns:
+        Indices of the points forming the triangular facets of the hull as
+        (-1, 3) array or None, if the points do not span a volume around the
+        interior point or the hull could not be built reliably.
+    """
+    norms = np.sqrt(np.sum(points**2, axis=1))
+    joggle = np.random.default_rng(0).uniform(-1.0, 1.0, points.shape)
+    points = points + HULL_JOGGLE * norms[:,np.newaxis] * joggle
+    tolerance = HULL_TOLERANCE * np.max(np.abs(points))
+    
+    # Initial tetrahedron from extremal points
+    i0 = np.argmin(points[:,0])
+    i1 = np.argmax(np.sum((points - points[i0])**2, axis=1))
+    direction = points[i1] - points[i0]
+    i2 = np.argmax(np.sum(np.cross(points - points[i0], direction)**2, axis=1))
+    normal = np.cross(direction, points[i2] - points[i0])
+    heights = np.dot(points - points[i0], normal)
+    i3 = np.argmax(np.abs(heights))
+    if abs(heights[i3]) <= tolerance * np.linalg.norm(normal):
+        return None
+    if heights[i3] > 0.0:
+        i1, i2 = i2, i1
+    hull = _Hull(points)
+    hull.add_faces([ ( i0, i1, i2 ), ( i0, i3, i1 ), ( i1, i3, i2 ),
+                     ( i2, i3, i0 ) ])
+    candidates = np.setdiff1d(np.arange(len(points)), ( i0, i1, i2, i3 ))
+    hull.assign_outside(candidates, hull.live_faces())
+    
+    # Add the farthest outside point of a face until all points are inside
+    while hull.pending:
+        iface = hull.pending.pop()
+        if not hull.alive[iface] or not len(hull.outside[iface]):
+            continue
+        candidates = hull.outside[iface]
+        dists = (np.dot(points[candidates], hull.normals[iface])
+                 - hull.offsets[iface])
+        hull.add_point(candidates[np.argmax(dists)])
+    # The interior point must be inside the hull of the points before joggling
+    faces = hull.live_faces()
+    if np.any(hull.offsets[faces] - np.dot(hull.normals[faces], interior)
+              <= 2.0 * HULL_JOGGLE * hull.scales[faces]):
+        return None
+    
+    # Reject hulls spoiled by rounding errors
+    dists = (np.dot(points, hull.normals[faces].transpose())
+             - hull.offsets[faces])
+    tolerances = HULL_TOLERANCE * np.maximum(hull.norms[:,np.newaxis],
+                                             hull.scales[faces])
+    if np.any(dists > tolerances):
+        return None
+    return hull.vertices[faces]
+
+
+class _Hull:
+    """Triangulated convex hull grown by the quickhull algorithm.
+    
+    Distances of points from faces are compared with a tolerance relative to
+    the size of the point and of the vertices of the face, as the dual points
+    of the planes may differ by orders of magnitude.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.norms = np.sqrt(np.sum(points**2, axis=1))
+        self.vertices = np.empty((0, 3), dtype=int)
+        self.normals = np.empty((0, 3), dtype=float)
+        self.offsets = np.empty((0, ), dtype=float)
+        self.scales = np.empty((0, ), dtype=float)
+        self.alive = np.empty((0, ), dtype=bool)
+        self.outside = []
+        self.pending = []
+        self._nface = 0
+
+
+    def live_faces(self):
+        """Returns the indices of the current faces."""
+        return np.flatnonzero(self.alive[:self._nface])
+
+
+    def add_faces(self, vertices):
+        """Adds faces with given vertices (counterclockwise from outside).
+        
+        Args:
+            vertices: Point indices of the faces as (-1, 3) array.
+        
+        Returns:
+            Indices of the new faces.
+        """
+        vertices = np.asarray(vertices, dtype=int).reshape(-1, 3)
+        start = self._nface
+        end = start + len(vertices)
+        if end > len(self.alive):
+            capacity = max(16, 2 * end)
+            self.vertices = np.resize(self.vertices, (capacity, 3))
+            self.normals = np.resize(self.normals, (capacity, 3))
+            self.offsets = np.resize(self.offsets, (capacity, ))
+            self.scales = np.resize(self.scales, (capacity, ))
+            self.alive = np.resize(self.alive, (capacity, ))
+        corners = self.points[vertices]
+        normals = np.cross(corners[:,1] - corners[:,0],
+                           corners[:,2] - corners[:,0])
+        normals /= np.sqrt(np.sum(normals**2, axis=1))[:,np.newaxis]
+        self.vertices[start:end] = vertices
+        self.normals[start:end] = normals
+        self.offsets[start:end] = np.sum(normals * corners[:,0], axis=1)
+        self.scales[start:end] = np.max(self.norms[vertices], axis=1)
+        self.alive[start:end] = True
+        self.outside += [ np.empty((0, ), dtype=int) ] * len(vertices)
+        self._nface = end
+        return np.arange(start, end)
+
+
+    def assign_outside(self, candidates, faces):
+        """Assigns each candidate point to a face it is outside of."""
+        if not len(candidates) or not len(faces):
+            return
+        dists = (np.dot(self.points[candidates], self.normals[faces].transpose())
+                 - self.offsets[faces])
+        tolerances = HULL_TOLERANCE * np.maximum(
+            self.norms[candidates,np.newaxis], self.scales[faces])
+        dists = np.where(dists > tolerances, dists, -np.inf)
+        best = np.argmax(dists, axis=1)
+        outside = dists[np.arange(len(candidates)), best] > -np.inf
+        candidates, best = candidates[outside], best[outside]
+        for iface in np.unique(best):
+            self.outside[faces[iface]] = candidates[best == iface]
+            self.pending.append(faces[iface])
+
+
+    def add_point(self, ipoint):
+        """Replaces the faces visible from a point by faces through it."""
+        faces = self.live_faces()
+        tolerances = HULL_TOLERANCE * np.maximum(self.scales[faces],
+                                                 self.norms[ipoint])
+        visible = faces[np.dot(self.normals[faces], self.points[ipoint])
+                        - self.offsets[faces] > tolerances]
+        edges = set()
+        for aa, bb, cc in self.vertices[visible].tolist():
+            edges.update(( (aa, bb), (bb, cc), (cc, aa) ))
+        candidates = np.concatenate([ self.outside[iface]
+                                      for iface in visible ])
+        for iface in visible:
+            self.alive[iface] = False
+            self.outside[iface] = np.empty((0, ), dtype=int)
+        newfaces = self.add_faces([ ( aa, bb, ipoint ) for aa, bb in edges
+                                    if (bb, aa) not in edges ])
+        candidates = candidates[candidates != ipoint]
+        self.assign_outside(candidates, newfaces)
@@ -0,0 +1,313 @@
+"""Selection of the atoms inside the bodies, either serially or in parallel."""
+import concurrent.futures
+import os
+import secrets
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from nanocut import output
+from nanocut.common import DEFAULT_CHUNK_SIZE
+
+__all__ = [ "shape_masks", "iter_candidate_blocks", "select_candidates",
+            "select_atoms" ]
+
+
+# Number of slabs per worker process (allows for some load balancing)
+SLABS_PER_JOB = 4
+
+
+def shape_masks(geo, bodies, atoms_coords, cells=None, inside=None):
+    """Decides for every body which atoms are inside of its shape.
+    
+    Args:
+        geo: Geometry of the base crystal.
+        bodies: List of bodies.
+        atoms_coords: Cartesian coordinates of the atoms.
+        cells: Lattice indices of the cells of the atoms for block culling (as
+            created by Geometry.gen_atoms()) or None.
+        inside: Index of a body known to contain all atoms or None.
+    
+    Returns:
+        Logical array of shape (nbody, natom) with True for every atom inside
+        the shape of a body.
+    """
+    masks = np.empty((len(bodies), len(atoms_coords)), dtype=bool)
+    for ibody, body in enumerate(bodies):
+        if ibody == inside:
+            masks[ibody] = True
+        elif cells is not None:
+            masks[ibody] = body.atoms_in_shape_culled(geo, atoms_coords, cells)
+        else:
+            masks[ibody] = body.atoms_in_shape_bounded(atoms_coords)
+    return masks
+
+
+def iter_candidate_blocks(geo, tree, direct=False,
+                          chunksize=DEFAULT_CHUNK_SIZE, culling=False,
+                          slab=None):
+    """Generates the atoms which can be selected by a tree.
+    
+    If the tree contains periodic bodies, the atoms inside of the shape of any
+    body are delivered together with the shape masks of all bodies, as
+    periodic images can only be masked out when processing the blocks in the
+    order of the enumeration. Otherwise, or if the atoms of the unit cell of a
+    periodic body are enumerated directly, the tree is evaluated directly and
+    only the selected atoms are delivered.
+    
+    Args:
+        geo: Geometry of the base crystal.
+        tree: CSGTree combining the bodies.
+        direct: If True, the atoms inside the body returned by
+            tree.enumeration_body() are enumerated directly (for periodic
+            bodies via Periodicity.iter_atoms_in_cell()), otherwise the
+            lattice grid of the cuboids returned by tree.containing_cuboids()
+            is filtered.
+        chunksize: Maximal number of lattice points per block.
+        culling: Whether block culling should be used when filtering the grid.
+        slab: Range (start, end) of the first lattice index, to which the
+            enumeration should be restricted, or None.
+    
+    Yields:
+        Coordinates and type indices of the atoms and a logical array of shape
+        (nbody, natom) with True for every atom inside the shape of a body, or
+        None if the tree does not contain periodic bodies.
+    """
+    periodic = tree.periodic
+    if direct:
+        inside = tree.enumeration_body()
+        body = tree.bodies[inside]
+        if body.periodic:
+            # The atoms of the unit cell contain no periodic images.
+            periodic = False
+            atoms = body.periodicity.iter_atoms_in_cell(geo, body, chunksize)
+        else:
+            atoms = body.iter_atoms_in_shape(geo, chunksize, slab)
+        blocks = ( block + (None, ) for block in atoms )
+    else:
+        inside = None
+        blocks = ( geo.gen_atoms(lattice_points) + (nmo, )
+                   for nmo, lattice_points in geo.iter_cuboid_rows(
+                       tree.containing_cuboids(), chunksize, indices=True,
+                       slab=slab) )
+    for atoms_coords, atoms_idx, cells in blocks:
+        if periodic or (culling and cells is not None):
+            masks = shape_masks(geo, tree.bodies, atoms_coords,
+                                cells if culling else None, inside)
+        if periodic:
+            candidates = np.flatnonzero(np.any(masks, axis=0))
+            yield (atoms_coords[candidates], atoms_idx[candidates],
+                   masks[:,candidates])
+            continue
+        if culling and cells is not None:
+            selected = tree.select(atoms_coords, masks)
+        else:
+            selected = tree.select(atoms_coords, inside=inside)
+        yield atoms_coords[selected], atoms_idx[selected], None
+
+
+def select_candidates(blocks, tree, seen, store=None):
+    """Selects the atoms from the candidate blocks.
+    
+    The blocks must be processed in the order of the enumeration, as only the
+    first of the periodic images of an atom is kept.
+    
+    Args:
+        blocks: Iterable over the blocks as generated by
+            iter_candidate_blocks().
+        tree: CSGTree combining the bodies.
+        seen: List of the unique boundary atoms found so far for each body.
+        store: AtomBuffer to append the selected atoms to or None.
+    
+    Returns:
+        Cartesian position and type indices of the selected atoms. If a store
+        is given, they are the memory mapped arrays of the store.
+    """
+    selected_coords = [ np.empty((0, 3), dtype=float) ]
+    selected_idx = [ np.empty((0, ), dtype=int) ]
+    for atoms_coords, atoms_idx, masks in blocks:
+        if masks is not None:
+            unique = np.array([ body.mask_unique(atoms_coords, mask, body_seen)
+                                for body, mask, body_seen
+                                in zip(tree.bodies, masks, seen) ],
+                              dtype=bool).reshape(masks.shape)
+            selected = tree.select(atoms_coords, unique)
+            atoms_coords = atoms_coords[selected]
+            atoms_idx = atoms_idx[selected]
+        if store is not None:
+            store.append(atoms_coords, atoms_idx)
+        else:
+            selected_coords.append(atoms_coords)
+            selected_idx.append(atoms_idx)
+    if store is not None:
+        store.flush()
+        return store.coords, store.idx
+    return np.vstack(selected_coords), np.concatenate(selected_idx)
+
+
+def select_atoms(geo, tree, direct=False, chunksize=DEFAULT_CHUNK_SIZE,
+                 culling=False, jobs=1, store=None):
+    """Selects the atoms described by a CSG tree.
+    
+    Args:
+        geo: Geometry of the base crystal.
+        tree: CSGTree combining the bodies.
+        direct: Whether the atoms of the enumeration body of the tree should
+            be enumerated directly (see iter_candidate_blocks()).
+        chunksize: Maximal number of lattice points per block.
+        culling: Whether block culling should be used when filtering the grid.
+        jobs: Number of worker processes.
+        store: AtomBuffer to store the selected atoms in or None.
+    
+    Returns:
+        Cartesian position and type indices of the selected atoms.
+    """
+    seen = [ [] for body in tree.bodies ]
+    # The unit cell of a periodic body is enumerated as a whole.
+    if direct and tree.bodies[tree.enumeration_body()].periodic and jobs > 1:
+        output.printstatus("Enumerating the unit cell of the periodic body "
+                           "in one process (--jobs ignored)", indentlevel=1)
+        jobs = 1
+    if jobs > 1:
+        blocks = iter_candidate_blocks_parallel(geo, tree, direct, chunksize,
+                                                culling, jobs)
+    else:
+        blocks = iter_candidate_blocks(geo, tree, direct, chunksize, culling)
+    return select_candidates(blocks, tree, seen, store)
+
+
+def iter_candidate_blocks_parallel(geo, tree, direct, chunksize, culling,
+                                   jobs):
+    """Generates the candidate atoms slab by slab using worker processes.
+    
+    The range of the first lattice index is split into slabs, which are
+    processed by a process pool. The workers return the candidate atoms of
+    their slab in a shared memory block. The slabs are delivered in the order
+    of the serial enumeration.
+    
+    Args:
+        geo: Geometry of the base crystal.
+        tree: CSGTree combining the bodies.
+        direct: Whether the atoms of the enumeration body of the tree should
+            be enumerated directly (see iter_candidate_blocks()).
+        chunksize: Maximal number of lattice points per block.
+        culling: Whether block culling should be used when filtering the grid.
+        jobs: Number of worker processes.
+    
+    Yields:
+        Same blocks as iter_candidate_blocks(), one per slab.
+    """
+    if direct:
+        body = tree.bodies[tree.enumeration_body()]
+        rows = geo.cuboid_row_intervals(body.containing_cuboid())[0]
+    else:
+        rows = geo.union_row_intervals(tree.containing_cuboids())[0]
+    if not len(rows):
+        return
+    imin, imax = rows[:,0].min(), rows[:,0].max() + 1
+    nslab = min(SLABS_PER_JOB * jobs, imax - imin)
+    bounds = np.linspace(imin, imax, nslab + 1).round().astype(int)
+    slabs = list(zip(bounds[:-1], bounds[1:]))
+    output.printstatus("Processing {:d} slabs with {:d} worker processes"
+                       .format(len(slabs), jobs), indentlevel=1)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker,
+        initargs=(geo, tree, direct, chunksize, culling))
+    futures = [ executor.submit(_select_slab, slab) for slab in slabs ]
+    nfetched = 0
+    try:
+        for future in futures:
+            name, natom = future.result()
+            nfetched += 1
+            if name is not None:
+                yield _fetch_shared_block(name, natom, _nmask(tree))
+    finally:
+        executor.shutdown(cancel_futures=True)
+        # Release the memory blocks of slabs which were not fetched.
+        for future in futures[nfetched:]:
+            if (not future.cancelled() and future.exception() is None
+                and future.result()[0] is not None):
+                _unlink_shared_block(future.result()[0])
+
+
+def _nmask(tree):
+    """Returns the number of masks delivered with each candidate block."""
+    return len(tree.bodies) if tree.periodic else 0
+
+
+# Settings of the worker processes, set by _init_worker().
+_WORKER = {}
+
+
+def _init_worker(geo, tree, direct, chunksize, culling):
+    """Stores the settings in the worker process."""
+    output.set_verbosity(0)
+    _WORKER.update(geo=geo, tree=tree, direct=direct, chunksize=chunksize,
+                   culling=culling)
+
+
+def _select_slab(slab):
+    """Collects the candidate atoms of a slab in a shared memory block.
+    
+    Args:
+        slab: Range (start, end) of the first lattice index.
+    
+    Returns:
+        Name of the shared memory block (None if there are no candidates) and
+        the number of candidate atoms in it.
+    """
+    blocks = list(iter_candidate_blocks(
+        _WORKER["geo"], _WORKER["tree"], _WORKER["direct"],
+        _WORKER["chunksize"], _WORKER["culling"], slab))
+    natom = sum(len(block[0]) for block in blocks)
+    if not natom:
+        return None, 0
+    nmask = _nmask(_WORKER["tree"])
+    name = "nanocut_" + secrets.token_hex(8)
+    shm = shared_memory.SharedMemory(name=name, create=True,
+                                     size=_shared_block_size(natom, nmask))
+    coords, idx, masks = _shared_block_arrays(shm, natom, nmask)
+    np.concatenate([ block[0] for block in blocks ], out=coords)
+    np.concatenate([ block[1] for block in blocks ], out=idx)
+    if nmask:
+        np.concatenate([ block[2] for block in blocks ], axis=1, out=masks)
+    del coords, idx, masks
+    shm.close()
+    # The block is released by the parent process, not on exit of the worker.
+    # POSIX blocks are registered with the resource tracker under their name
+    # with a leading slash.
+    if os.name == "posix":
+        resource_tracker.unregister("/" + name, "shared_memory")
+    return name, natom
+
+
+def _shared_block_size(natom, nmask):
+    """Returns the size of a shared block with natom atoms in bytes."""
+    return natom * (3 * 8 + 8 + nmask)
+
+
+def _shared_block_arrays(shm, natom, nmask):
+    """Returns views of the coordinates, type indices and body masks."""
+    coords = np.ndarray((natom, 3), dtype=np.float64, buffer=shm.buf)
+    idx = np.ndarray((natom, ), dtype=np.int64, buffer=shm.buf,
+                     offset=natom * 3 * 8)
+    masks = np.ndarray((nmask, natom), dtype=bool, buffer=shm.buf,
+                       offset=natom * 4 * 8)
+    return coords, idx, masks
+
+
+def _fetch_shared_block(name, natom, nmask):
+    """Copies the content of a shared block and releases it."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        coords, idx, masks = ( np.array(array) for array
+                               in _shared_block_arrays(shm, natom, nmask) )
+    finally:
+        shm.close()
+        shm.unlink()
+    return coords, idx, masks if nmask else None
+
+
+def _unlink_shared_block(name):
+    """Releases a shared block without reading it."""
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
@@ -1,5 +1,7 @@
 import numpy as np
-from nanocut.body import Body
+from nanocut.body import Body, quadratic_row_intervals
+from nanocut.body import BLOCK_INSIDE, BLOCK_OUTSIDE, BLOCK_BOUNDARY
+from nanocut.common import CULLING_TOLERANCE
 
 class Sphere(Body):
     """Class for spheres"""
@@ -10,6 +12,8 @@ class Sphere(Body):
                  "shift_vector": ( "floatarray", (3,), True, True ),
                  "radius": ( "float", None, False, False ),
                  }
+    
+    exact_enumeration = True
 
     
     def __init__(self, geometry, period, **kwargs):
@@ -29,8 +33,35 @@ class Sphere(Body):
                 + self.shift_vector)
 
 
-    def atoms_inside(self, atoms, periodicity=None):
-        """Decides which atoms are inside the body (see Body class)."""
+    def atoms_in_shape(self, atoms):
+        """Decides which atoms are inside the shape (see Body class)."""
         dists = np.sqrt(np.sum((atoms - self.shift_vector)**2, axis=1))
         return (dists <= self.radius)
-    
\ No newline at end of file
+
+
+    def classify_blocks(self, corners):
+        """Classifies convex blocks with respect to the body (see Body
+        class)."""
+        dists = np.sqrt(np.sum((corners - self.shift_vector)**2, axis=2))
+        inside = np.all(dists <= self.radius - CULLING_TOLERANCE, axis=1)
+        # Nearest point of the bounding box of the block to the center
+        nearest = np.clip(self.shift_vector, corners.min(axis=1),
+                          corners.max(axis=1))
+        mindists = np.sqrt(np.sum((nearest - self.shift_vector)**2, axis=1))
+        outside = mindists > self.radius + CULLING_TOLERANCE
+        return np.where(inside, BLOCK_INSIDE,
+                        np.where(outside, BLOCK_OUTSIDE, BLOCK_BOUNDARY))
+
+
+    def row_intervals(self, geometry, rows):
+        """Determines the atoms inside the body along lattice rows (see Body
+        class)."""
+        # Condition: |w + k * kvec|**2 <= radius**2, with w being the position
+        # of the basis atom in the cell of (i, j, 0) relative to the center.
+        kvec = geometry.latvecs[2]
+        ww = (np.dot(rows, geometry.latvecs[0:2])[:,np.newaxis,:]
+              + geometry.basis - self.shift_vector)
+        wwsquare = np.sum(ww**2, axis=2)
+        return quadratic_row_intervals(
+            np.dot(kvec, kvec), 2.0 * np.dot(ww, kvec),
+            wwsquare - self.radius**2, wwsquare + self.radius**2)
@@ -0,0 +1,126 @@
+import itertools
+import numpy as np
+from nanocut.common import SYMMETRY_TOLERANCE
+from nanocut.periodicity import reduce_axis
+
+__all__ = [ "lattice_rotations", "space_group_operations", "point_group",
+            "internal_translations" ]
+
+
+def lattice_rotations(latvecs, tolerance=SYMMETRY_TOLERANCE):
+    """Returns the rotations mapping a lattice onto itself.
+    
+    The integer transformations of the reduced lattice vectors with elements
+    -1, 0 and 1 are tested for keeping the metric of the lattice.
+    
+    Args:
+        latvecs: Lattice vectors.
+        tolerance: Maximal displacement of the lattice vectors.
+    
+    Returns:
+        Cartesian rotation matrices R (including improper ones) as (-1, 3, 3)
+        array. A vector x is rotated by np.dot(x, R).
+    """
+    latvecs = np.asarray(latvecs, dtype=float)
+    reduced = np.dot(reduce_axis(np.eye(3, dtype=int), latvecs), latvecs)
+    metric = np.dot(reduced, reduced.transpose())
+    trafos = np.array(list(itertools.product((-1, 0, 1), repeat=9)),
+                      dtype=float).reshape(-1, 3, 3)
+    metrics = np.einsum("nij,jk,nlk->nil", trafos, metric, trafos)
+    maxdiff = 2.0 * tolerance * np.sqrt(np.max(np.diag(metric)))
+    keep = np.all(np.abs(metrics - metric) <= maxdiff, axis=(1, 2))
+    return np.einsum("ij,njk,kl->nil", np.linalg.inv(reduced), trafos[keep],
+                     reduced)
+
+
+def space_group_operations(geometry, tolerance=SYMMETRY_TOLERANCE):
+    """Returns the operations mapping the crystal onto itself.
+    
+    Args:
+        geometry: Geometry of the crystal.
+        tolerance: Maximal displacement of the atoms.
+    
+    Returns:
+        Tuple of the cartesian rotation matrices as (-1, 3, 3) array and the
+        corresponding translations as (-1, 3) array. Atom x is mapped onto
+        np.dot(x, R) + t (modulo lattice vectors). For crystals with internal
+        translations, a rotation appears once for every translation.
+    """
+    samenames = _same_species(geometry)
+    rotations = []
+    translations = []
+    for rotation in lattice_rotations(geometry.latvecs, tolerance):
+        images = np.dot(geometry.basis, rotation)
+        for trans in geometry.basis[samenames[0]] - images[0]:
+            if _basis_mapping(geometry, rotation, trans, samenames,
+                              tolerance) is not None:
+                rotations.append(rotation)
+                translations.append(trans)
+    return np.array(rotations), np.array(translations)
+
+
+def point_group(geometry, tolerance=SYMMETRY_TOLERANCE):
+    """Returns the point group of the crystal.
+    
+    Args:
+        geometry: Geometry of the crystal.
+        tolerance: Maximal displacement of the atoms.
+    
+    Returns:
+        Distinct cartesian rotation matrices of the space group operations as
+        (-1, 3, 3) array (see space_group_operations()).
+    """
+    rotations, translations = space_group_operations(geometry, tolerance)
+    keys = np.round(rotations.reshape(-1, 9) / tolerance).astype(np.int64)
+    dummy, first = np.unique(keys, axis=0, return_index=True)
+    return rotations[np.sort(first)]
+
+
+def internal_translations(geometry, tolerance=SYMMETRY_TOLERANCE):
+    """Returns the pure translations mapping the crystal onto itself.
+    
+    Args:
+        geometry: Geometry of the crystal.
+        tolerance: Maximal displacement of the atoms.
+    
+    Returns:
+        Cartesian translations (including the zero vector) as (-1, 3) array,
+        which map each basis atom onto a basis atom of the same species
+        (modulo lattice vectors).
+    """
+    samenames = _same_species(geometry)
+    identity = np.eye(3, dtype=float)
+    translations = [ trans for trans
+                     in geometry.basis[samenames[0]] - geometry.basis[0]
+                     if _basis_mapping(geometry, identity, trans, samenames,
+                                       tolerance) is not None ]
+    return np.array(translations)
+
+
+def _same_species(geometry):
+    """Returns whether the basis atoms are of the same species pairwise."""
+    species = geometry.get_species()[1]
+    return species[:,np.newaxis] == species[np.newaxis,:]
+
+
+def _basis_mapping(geometry, rotation, translation, samenames, tolerance):
+    """Checks whether an operation maps the basis onto itself.
+    
+    Returns:
+        Basis index of the image of each basis atom and the lattice indices of
+        the cell it is in, or None if the basis is not mapped onto itself.
+    """
+    lattice = geometry.lattice
+    basis = geometry.basis
+    images = np.dot(basis, rotation) + translation
+    relative = lattice.to_relative(images[:,np.newaxis,:]
+                                   - basis[np.newaxis,:,:])
+    shifts = np.round(relative)
+    residues = lattice.to_cartesian(relative - shifts)
+    matching = np.logical_and(np.sum(residues**2, axis=2) < tolerance**2,
+                              samenames)
+    if not np.all(np.any(matching, axis=1)):
+        return None
+    permutation = np.argmax(matching, axis=1)
+    return (permutation,
+            shifts[np.arange(len(basis)), permutation].astype(int))
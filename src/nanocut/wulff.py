@@ -0,0 +1,75 @@
+import numpy as np
+from nanocut.common import EPSILON
+from nanocut.polyhedron import Polyhedron
+from nanocut.symmetry import point_group
+from nanocut.output import error, printstatus
+
+__all__ = [ "Wulff" ]
+
+
+class Wulff(Polyhedron):
+    """Class for polyhedra built from symmetry equivalent facets (Wulff
+    construction)."""
+
+    # (type, shape, optional, has_coordsys_version)
+    arguments = {
+                 "shift_vector": ( "floatarray", (3,), True, True ),
+                 "facets_energy": ( "floatarray", (-1,4), True, False ),
+                 "facets_distance": ( "floatarray", (-1,4), True, False ),
+                 "radius": ( "float", None, True, False ),
+    }
+
+    def __init__(self, geometry, period, **kwargs):
+        """Constructs Wulff instance.
+        
+        Keyword args:
+            shift_vector: Origin of the body.
+            facets_energy: Miller indices of the facet families with their
+                surface energies.
+            facets_distance: Miller indices of the facet families with their
+                distances from the origin.
+            radius: Distance of the facets with the lowest surface energy
+                from the origin.
+        """
+        families = self.pop_families(kwargs)
+        if np.any(np.all(abs(families[:,0:3]) < EPSILON, axis=1)):
+            error("Empty miller index tuple")
+        normals = geometry.bravais_lattice.miller_to_normal(families[:,0:3])
+        normals /= np.sqrt(np.sum(normals**2, axis=1))[:,np.newaxis]
+
+        # Expand families with the point group of the crystal. Duplicates are
+        # removed by the base class.
+        rotations = point_group(geometry)
+        planes_normal = np.empty((len(rotations), len(families), 4),
+                                 dtype=float)
+        planes_normal[:,:,0:3] = np.einsum("fj,njk->nfk", normals, rotations)
+        planes_normal[:,:,3] = families[:,3]
+        kwargs["planes_normal"] = planes_normal.reshape(-1, 4)
+        kwargs["planes_normal_coordsys"] = "cartesian"
+        Polyhedron.__init__(self, geometry, period, **kwargs)
+        printstatus("Number of facets of the Wulff shape: {:d} (from {:d} "
+                    "symmetry operations)".format(len(self.planes_normal),
+                                                  len(rotations)))
+
+
+    @staticmethod
+    def pop_families(kwargs):
+        # Convert surface energies into distances from the origin
+        energies = kwargs.pop("facets_energy", None)
+        distances = kwargs.pop("facets_distance", None)
+        radius = kwargs.pop("radius", None)
+        if (energies is None) == (distances is None):
+            error("Exactly one of facets_energy and facets_distance must be "
+                  "specified")
+        if distances is not None:
+            if np.any(distances[:,3] <= 0.0):
+                error("Facet distances must be positive")
+            return distances
+        if radius is None:
+            error("Radius must be specified together with facets_energy")
+        if radius <= 0.0:
+            error("Radius must be positive")
+        if np.any(energies[:,3] <= 0.0):
+            error("Surface energies must be positive")
+        energies[:,3] *= radius / np.min(energies[:,3])
+        return energies
@@ -0,0 +1,97 @@
+"""Benchmarks the masking of periodic images for slabs with growing cells.
+
+The in-plane cell is repeated 1, 2, 4, ... times up to MAXREPETITION
+(default: 32) along both periodic directions.
+
+Compares Periodicity.mask_unique() with the former quadratic algorithm and
+checks that both yield the same mask. Run it from the test directory:
+
+    python3 benchmark_mask_unique.py [MAXREPETITION]
+"""
+import sys
+import time
+import configparser
+import numpy as np
+sys.path.insert(0, "../src")
+import nanocut.common as nc
+from nanocut import output, geometry, periodicity, periodic_2D_plane
+
+CONFIG = """
+[geometry]
+lattice_vectors:
+  3.74774 0 0
+  0 3.74774 0
+  0 0 3.74774
+basis:
+  Re 0   0   0
+  O  0.5 0   0
+  O  0   0.5 0
+  O  0   0   0.5
+
+[periodicity]
+period_type: 2D
+axis:
+  1 1 3
+  1 3 1
+axis_repetition: {0:d} {0:d}
+
+[periodic_2D_plane:slab]
+thickness: 10
+"""
+
+
+def mask_unique_quadratic(period, coords, mask):
+    """Former implementation comparing each boundary atom with all others."""
+    unique = np.array(mask, dtype=bool)
+    relcoords, shifts = period.splitcoords(coords)
+    relcoords = np.where(
+        np.greater(relcoords, 1.0 - nc.RELATIVE_PERIODIC_TOLERANCE),
+        relcoords - 1.0, relcoords)
+    onbounds = np.flatnonzero(np.any(np.less(relcoords, 0.01), axis=1))
+    onbounds_cart = (np.dot(relcoords[onbounds], period.axis_cart)
+                     + shifts[onbounds])
+    for ii in range(len(onbounds_cart)):
+        if not unique[onbounds[ii]]:
+            continue
+        diff = onbounds_cart[ii+1:] - onbounds_cart[ii]
+        equiv = np.flatnonzero(np.less(np.sum(diff**2, axis=1),
+                                       nc.DISTANCE_TOLERANCE**2))
+        unique[onbounds[equiv + ii + 1]] = False
+    return unique
+
+
+def main():
+    output.set_verbosity(0)
+    maxrep = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    print("{:>4s} {:>10s} {:>10s} {:>12s} {:>12s}".format(
+        "rep", "atoms", "images", "quadratic/s", "sweep/s"))
+    rep = 1
+    while rep <= maxrep:
+        config = configparser.ConfigParser()
+        config.read_string(CONFIG.format(rep))
+        geo = geometry.Geometry.fromdict(config["geometry"])
+        period = periodicity.Periodicity.fromdict(geo, config["periodicity"])
+        body = periodic_2D_plane.Periodic2DPlane.fromdict(
+            geo, period, config["periodic_2D_plane:slab"])
+        latpoints = np.vstack(list(geo.iter_cuboid_rows(
+            body.containing_cuboid())))
+        atoms, atoms_idx = geo.gen_atoms(latpoints)
+        atoms = atoms - body.shift_vector
+        mask = body.atoms_in_shape(atoms + body.shift_vector)
+        start = time.perf_counter()
+        reference = mask_unique_quadratic(period, atoms, mask)
+        time_quadratic = time.perf_counter() - start
+        start = time.perf_counter()
+        result = period.mask_unique(atoms, mask)
+        time_sweep = time.perf_counter() - start
+        if not np.array_equal(result, reference):
+            print("Mismatch for repetition {:d}".format(rep))
+            sys.exit(1)
+        nimages = int(np.sum(mask)) - int(np.sum(result))
+        print("{:4d} {:10d} {:10d} {:12.3f} {:12.3f}".format(
+            rep, int(np.sum(result)), nimages, time_quadratic, time_sweep))
+        rep *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 import unittest
 import test_nanocut
+import test_polyhedron
+import test_commensurate
 
 runner = unittest.TextTestRunner()
-runner.run(unittest.TestSuite(test_nanocut.getsuites()))
+runner.run(unittest.TestSuite(test_nanocut.getsuites()
+                              + test_polyhedron.getsuites()
+                              + test_commensurate.getsuites()))
@@ -0,0 +1,97 @@
+"""Tests of the search for commensurate supercells with known results.
+
+Run it from the test directory (or via test.py).
+"""
+import sys
+import unittest
+import subprocess
+import numpy as np
+sys.path.insert(0, "../src")
+from nanocut import commensurate
+
+HEXAGONAL = np.array([[ 1.0, 0.0 ], [ 0.5, np.sqrt(3.0) / 2.0 ]])
+SQUARE = np.eye(2)
+RECTANGULAR = np.array([[ 1.0, 0.0 ], [ 0.0, 1.5 ]])
+
+# Twist angles of the sqrt(7) x sqrt(7) and sqrt(13) x sqrt(13) supercells
+# of twisted hexagonal lattices (cos(twist) = 13/14 and 23/26)
+TWIST7 = np.degrees(np.arccos(13.0 / 14.0))
+TWIST13 = np.degrees(np.arccos(23.0 / 26.0))
+
+
+class SearchTestCase(unittest.TestCase):
+
+    def testTwistedHexagonal(self):
+        found = commensurate.search_commensurate_cells(
+            HEXAGONAL, HEXAGONAL, 30, maxstrain=1e-6, twist=(0.0, 30.0))
+        self.assertEqual(found["natoms"].tolist(), [ 2, 14, 26 ])
+        self.assertEqual(found["ncell1"].tolist(), [ 1, 7, 13 ])
+        self.assertEqual(found["ncell2"].tolist(), [ 1, 7, 13 ])
+        self.assertTrue(np.all(np.abs(found["twist"]
+                                      - [ 0.0, TWIST7, TWIST13 ]) < 1e-6))
+        self.assertTrue(np.all(found["strain"] < 1e-10))
+
+
+    def testRectangular(self):
+        found = commensurate.search_commensurate_cells(
+            SQUARE, RECTANGULAR, 10, maxstrain=1e-6)
+        self.assertEqual(found["ncell1"][0], 3)
+        self.assertEqual(found["ncell2"][0], 2)
+        self.assertEqual(abs(round(np.linalg.det(found["axis1"][0]))), 3)
+        self.assertEqual(abs(round(np.linalg.det(found["axis2"][0]))), 2)
+        self.assertTrue(abs(found["twist"][0]) < 1e-6)
+
+
+    def testLatticeSymmetry(self):
+        self.assertEqual(commensurate.rotation_order(HEXAGONAL), 6)
+        self.assertEqual(commensurate.rotation_order(SQUARE), 4)
+        self.assertEqual(commensurate.rotation_order(RECTANGULAR), 2)
+        # Twist angles differing by 30 degrees are equivalent
+        found = commensurate.search_commensurate_cells(
+            SQUARE, HEXAGONAL, 200, twist=(0.0, 90.0))
+        self.assertEqual(found["twist"][0], 0.0)
+        keys = np.column_stack(( found["ncell1"], found["ncell2"],
+                                 np.round(found["strain"], 8),
+                                 np.round(np.mod(found["twist"], 30.0), 4) ))
+        self.assertEqual(len(np.unique(keys, axis=0)), len(keys))
+
+
+class CommandLineTestCase(unittest.TestCase):
+
+    def testTwistedGraphene(self):
+        subprocess.call([ "../bin/nanocut", "--verbosity", "0",
+                          "--commensurate", "commensurate/graphene.ini",
+                          "--twist-angles", "0", "30", "--max-strain", "1e-6",
+                          "--max-atoms", "60", "commensurate/graphene.ini",
+                          "current_result.txt" ])
+        table = np.loadtxt("current_result.txt", ndmin=2)
+        self.assertEqual(table[:,0].tolist(), [ 4, 28, 52 ])
+        self.assertEqual(table[:,1].tolist(), [ 1, 7, 13 ])
+        self.assertEqual(table[:,2].tolist(), [ 1, 7, 13 ])
+        self.assertTrue(np.all(np.abs(table[:,4]
+                                      - [ 0.0, TWIST7, TWIST13 ]) < 1e-4))
+        # Supercell vectors in the format of the axis option
+        for row in table:
+            axis1 = row[5:11].reshape(2, 3)
+            axis2 = row[11:17].reshape(2, 3)
+            self.assertEqual(abs(round(np.linalg.det(axis1[:,0:2]))), row[1])
+            self.assertEqual(abs(round(np.linalg.det(axis2[:,0:2]))), row[2])
+
+
+    def testRectangular(self):
+        subprocess.call([ "../bin/nanocut", "--verbosity", "0",
+                          "--commensurate", "commensurate/rectangular.ini",
+                          "--max-strain", "1e-6", "--max-atoms", "10",
+                          "commensurate/square.ini", "current_result.txt" ])
+        table = np.loadtxt("current_result.txt", ndmin=2)
+        self.assertEqual(table[0,0:3].tolist(), [ 5, 3, 2 ])
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(SearchTestCase, 'test'),
+             unittest.makeSuite(CommandLineTestCase, 'test') ]
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -1,46 +1,112 @@
 import unittest
 import numpy as np
 import glob
+import os
 import subprocess
 
 class NanocutTestCase(unittest.TestCase):
 
     _tests = []
+    _args = []
+    # Number of times the structure is written into the same result file
+    _repeat = 1
 
     def errormsg(self, filename, line):
         return "ERROR in File: '" + filename + "' in line " + str(line)
 
     def testTags(self):
         for filename in self._tests:
-            print(filename)
-            subprocess.call([ "../bin/nanocut", "--verbosity", "0",
-                             filename, "current_result.xyz" ])
-            result_file = open("current_result.xyz", "r")
-            result = result_file.readlines()
-            orig_file = open(filename[:-4] + ".xyz", "r")
-            orig = orig_file.readlines()
-            ii = 0
-            for ii in range(len(orig)):
-                origwords = orig[ii].split()
-                resultwords = result[ii].split()                
-                if ii == 0:
-                    self.assertEqual(len(resultwords), 1)
-                    self.assertEqual(int(origwords[0]), int(resultwords[0]))
-                elif ii > 1:
-                    self.assertEqual(len(resultwords), 4)
-                    self.assertEqual(origwords[0].lower(),
-                                     resultwords[0].lower())
-                    origcoords = np.array(origwords[1:4], dtype=float)
-                    resultcoords = np.array(resultwords[1:4], dtype=float)
-                    diff = np.sqrt(np.sum((origcoords - resultcoords)**2))
-                    self.assertTrue(diff < 1e-8, self.errormsg(filename, ii))
+            # Each input is reported separately
+            with self.subTest(filename=filename, args=self._args):
+                self.compare(filename)
+
+    def compare(self, filename):
+        print(filename)
+        if os.path.exists("current_result.xyz"):
+            os.remove("current_result.xyz")
+        for irepeat in range(self._repeat):
+            subprocess.call([ "../bin/nanocut", "--verbosity", "0" ]
+                            + self._args
+                            + [ filename, "current_result.xyz" ])
+        result_file = open("current_result.xyz", "r")
+        result = result_file.readlines()
+        orig_file = open(filename[:-4] + ".xyz", "r")
+        orig = orig_file.readlines() * self._repeat
+        self.assertEqual(len(orig), len(result))
+        # Line numbers of the atom numbers of the individual structures
+        headers = [ 0 ]
+        while headers[-1] < len(orig):
+            headers.append(headers[-1] + int(orig[headers[-1]]) + 2)
+        ii = 0
+        for ii in range(len(orig)):
+            origwords = orig[ii].split()
+            resultwords = result[ii].split()                
+            if ii in headers:
+                self.assertEqual(len(resultwords), 1)
+                self.assertEqual(int(origwords[0]), int(resultwords[0]))
+            elif ii - 1 not in headers:
+                self.assertEqual(len(resultwords), 4)
+                self.assertEqual(origwords[0].lower(),
+                                 resultwords[0].lower())
+                origcoords = np.array(origwords[1:4], dtype=float)
+                resultcoords = np.array(resultwords[1:4], dtype=float)
+                diff = np.sqrt(np.sum((origcoords - resultcoords)**2))
+                self.assertTrue(diff < 1e-8, self.errormsg(filename, ii))
 
 class SimpleTestCase(NanocutTestCase):
     _tests = glob.glob("nanocut/*.ini")
 
+class ChunkedTestCase(NanocutTestCase):
+    _tests = glob.glob("nanocut/*.ini")
+    _args = [ "--chunk-size", "37" ]
+
+class ChunkSweepTestCase(NanocutTestCase):
+    # Inputs with atoms on the boundary of the bodies
+    _tests = [ "nanocut/cylinder.ini", "nanocut/supercell-skewed.ini",
+               "nanocut/house-base.ini" ]
+    _chunksizes = [ 1, 7, 13, 64 ]
+
+    def testTags(self):
+        for chunksize in self._chunksizes:
+            self._args = [ "--chunk-size", str(chunksize) ]
+            NanocutTestCase.testTags(self)
+
+class GridFilterTestCase(NanocutTestCase):
+    _tests = glob.glob("nanocut/*.ini")
+    _args = [ "--grid-filter" ]
+
+class BlockCullingTestCase(NanocutTestCase):
+    _tests = glob.glob("nanocut/*.ini")
+    _args = [ "--grid-filter", "--block-culling" ]
+
+class ParallelTestCase(NanocutTestCase):
+    _tests = glob.glob("nanocut/*.ini")
+    _args = [ "--jobs", "2" ]
+
+class ScratchTestCase(NanocutTestCase):
+    _tests = glob.glob("nanocut/*.ini")
+    _args = [ "--scratch-dir", "." ]
+
+class AppendTestCase(NanocutTestCase):
+    _tests = [ "nanocut/sphere.ini", "nanocut/plane.ini" ]
+    _args = [ "--append" ]
+    _repeat = 2
+
+class TerminationsTestCase(NanocutTestCase):
+    _tests = glob.glob("terminations/*.ini")
+    _args = [ "--terminations" ]
+
 def getsuites():
     """Returns the test suites defined in the module."""
-    return [ unittest.makeSuite(SimpleTestCase, 'test')]
+    return [ unittest.makeSuite(SimpleTestCase, 'test'),
+             unittest.makeSuite(ChunkedTestCase, 'test'),
+             unittest.makeSuite(ChunkSweepTestCase, 'test'),
+             unittest.makeSuite(GridFilterTestCase, 'test'),
+             unittest.makeSuite(BlockCullingTestCase, 'test'),
+             unittest.makeSuite(ParallelTestCase, 'test'),
+             unittest.makeSuite(ScratchTestCase, 'test'),
+             unittest.makeSuite(AppendTestCase, 'test'),
+             unittest.makeSuite(TerminationsTestCase, 'test') ]
 
 if __name__ == "__main__": 
     runner = unittest.TextTestRunner()
@@ -0,0 +1,192 @@
+"""Tests of the construction of polyhedra and of their atom selection.
+
+Run it from the test directory (or via test.py).
+"""
+import sys
+import unittest
+import configparser
+import numpy as np
+sys.path.insert(0, "../src")
+from nanocut import output, geometry, periodicity, polyhedron
+
+# Simple cubic crystal, so that atoms are exactly on the planes below
+CONFIG = """
+[geometry]
+lattice_vectors:
+  1 0 0
+  0 1 0
+  0 0 1
+basis:
+  C 0 0 0
+
+[periodicity]
+period_type: 0D
+
+[polyhedron:1]
+planes_normal:
+{planes}
+planes_normal_coordsys: cartesian
+shift_vector: {shift}
+shift_vector_coordsys: cartesian
+"""
+
+# Octahedron |x| + |y| + |z| <= 3
+OCTAHEDRON = [ [ sx, sy, sz, 3.0 / np.sqrt(3.0) ]
+               for sx in ( -1, 1 ) for sy in ( -1, 1 ) for sz in ( -1, 1 ) ]
+
+# Cube |x|, |y|, |z| <= 2
+CUBE = [ [ 1, 0, 0, 2 ], [ -1, 0, 0, 2 ], [ 0, 1, 0, 2 ],
+         [ 0, -1, 0, 2 ], [ 0, 0, 1, 2 ], [ 0, 0, -1, 2 ] ]
+
+
+def create_polyhedron(planes, shift=( 0.0, 0.0, 0.0 )):
+    """Creates a polyhedron in the simple cubic crystal."""
+    output.set_verbosity(0)
+    planes = "\n".join("  " + " ".join(repr(float(xx)) for xx in plane)
+                       for plane in planes)
+    config = configparser.ConfigParser()
+    config.read_string(CONFIG.format(
+        planes=planes, shift=" ".join(repr(float(xx)) for xx in shift)))
+    geo = geometry.Geometry.fromdict(config["geometry"])
+    period = periodicity.Periodicity.fromdict(geo, config["periodicity"])
+    return polyhedron.Polyhedron.fromdict(geo, period,
+                                          config["polyhedron:1"])
+
+
+def lattice_points(extent):
+    """Returns the points of the simple cubic lattice in a cube."""
+    grid = np.arange(-extent, extent + 1, dtype=float)
+    return np.array(np.meshgrid(grid, grid, grid,
+                                indexing="ij")).reshape(3, -1).transpose()
+
+
+def brute_force_polyhedron(planes):
+    """Returns the face planes and vertices of the polyhedron containing the
+    origin from the intersections of all plane triples."""
+    points = polyhedron._all_intersections(planes, np.zeros((3, ), dtype=float))
+    vertices = []
+    for point in points:
+        if not any(np.max(np.abs(point - vertex)) < 1e-8
+                   for vertex in vertices):
+            vertices.append(point)
+    vertices = np.array(vertices)
+    onplane = np.abs(np.dot(vertices, planes[:,0:3].T) - planes[:,3]) < 1e-8
+    faces = [ iplane for iplane in range(len(planes))
+              if np.sum(onplane[:,iplane]) >= 3
+              and np.linalg.matrix_rank(vertices[onplane[:,iplane]][1:]
+                                        - vertices[onplane[:,iplane]][0],
+                                        tol=1e-8) == 2 ]
+    return planes[faces], vertices
+
+
+def same_rows(array1, array2):
+    """Checks whether two arrays contain the same rows in any order."""
+    if array1.shape != array2.shape:
+        return False
+    return all(np.any(np.max(np.abs(array2 - row), axis=1) < 1e-8)
+               for row in array1)
+
+
+class HalfspaceIntersectionTestCase(unittest.TestCase):
+
+    def testRedundantPlanes(self):
+        # Far away, touching the cube in a vertex and touching it in an edge
+        redundant = [ [ 1, 1, 1, 10 ], [ 1, 0, 0, 5 ],
+                      [ 1, 1, 1, 6.0 / np.sqrt(3.0) ],
+                      [ 1, 1, 0, 4.0 / np.sqrt(2.0) ] ]
+        body = create_polyhedron(redundant + CUBE)
+        expected = np.array(CUBE, dtype=float)
+        self.assertEqual(len(body.planes_normal), len(expected))
+        for plane in expected:
+            self.assertTrue(np.any(np.all(
+                np.abs(body.planes_normal - plane) < 1e-10, axis=1)))
+        self.assertEqual(len(body.corners), 8)
+        self.assertTrue(np.all(np.abs(np.abs(body.corners) - 2.0) < 1e-10))
+
+
+    def testContainingCuboid(self):
+        shift = np.array([ 1.0, 2.0, 3.0 ])
+        far = [ [ 1, 0, 0, 10 ], [ 0, -1, 0, 10 ], [ 1, 1, 1, 20 ] ]
+        body = create_polyhedron(OCTAHEDRON + far, shift)
+        self.assertEqual(len(body.planes_normal), len(OCTAHEDRON))
+        self.assertEqual(len(body.corners), 6)
+        cuboid = body.containing_cuboid()
+        self.assertTrue(np.all(np.abs(cuboid[0] - (shift - 3.0)) < 1e-10))
+        self.assertTrue(np.all(np.abs(cuboid[1] - (shift + 3.0)) < 1e-10))
+
+
+    def testOriginOutside(self):
+        # Planes not enclosing the origin: the cube 4 <= x, y, z <= 8 is taken
+        cube = [ [ 1, 0, 0, 4 ], [ 1, 0, 0, 8 ], [ 0, 1, 0, 4 ],
+                 [ 0, 1, 0, 8 ], [ 0, 0, 1, 4 ], [ 0, 0, 1, 8 ] ]
+        body = create_polyhedron(cube)
+        self.assertEqual(len(body.corners), 8)
+        cuboid = body.containing_cuboid()
+        self.assertTrue(np.all(np.abs(cuboid[0] - 4.0) < 1e-10))
+        self.assertTrue(np.all(np.abs(cuboid[1] - 8.0) < 1e-10))
+        atoms = lattice_points(9)
+        # Atoms on the planes with the larger distances are outside
+        inside = body.atoms_in_shape(atoms)
+        self.assertTrue(np.array_equal(
+            inside, np.all((atoms >= 4.0) & (atoms < 8.0), axis=1)))
+
+
+    def testRandomPlanes(self):
+        # Vertices and faces from the convex hull of the dual points must be
+        # the same as the ones from all plane triples
+        rng = np.random.default_rng(0)
+        for iset in range(20):
+            nplane = rng.integers(8, 80)
+            normals = rng.normal(size=(nplane, 3))
+            normals /= np.sqrt(np.sum(normals**2, axis=1))[:,np.newaxis]
+            planes = np.column_stack(( normals,
+                                       rng.uniform(1.0, 3.0, nplane) ))
+            # Planes touching the body in a vertex
+            dummy, vertices = polyhedron.halfspace_intersection(planes)
+            touching = rng.normal(size=(5, 3))
+            touching /= np.sqrt(np.sum(touching**2, axis=1))[:,np.newaxis]
+            touching = np.column_stack((
+                touching, np.max(np.dot(touching, vertices.T), axis=1) ))
+            planes = np.vstack(( planes, touching ))
+            center = polyhedron._interior_point(planes)
+            self.assertIsNotNone(polyhedron._hull_vertices(planes, center))
+            faces, vertices = polyhedron.halfspace_intersection(planes)
+            expected_faces, expected_vertices = brute_force_polyhedron(planes)
+            self.assertTrue(same_rows(vertices, expected_vertices))
+            self.assertTrue(same_rows(faces, expected_faces))
+
+
+class LearnedPlaneOrderTestCase(unittest.TestCase):
+
+    def testSameMask(self):
+        # Planes with many atoms on them, in an order different from the
+        # learned one. Atoms on planes with negative distances from the
+        # origin are inside, those on planes with positive distances not.
+        cube = [ [ 1, 0, 0, 2 ], [ 1, 0, 0, -2 ], [ 0, 1, 0, 2 ],
+                 [ 0, 1, 0, -2 ], [ 0, 0, 1, 2 ], [ 0, 0, 1, -2 ] ]
+        body = create_polyhedron(cube + OCTAHEDRON + [ [ 1, 2, 0, 1 ] ])
+        atoms = lattice_points(4)
+        self.assertIsNone(body._plane_order)
+        reference = body.atoms_in_shape(atoms)
+        self.assertIsNotNone(body._plane_order)
+        onplanes = np.any(np.abs(np.dot(atoms, body.planes_normal[:,0:3].T)
+                                 - body.planes_normal[:,3]) < 1e-10, axis=1)
+        self.assertTrue(np.any(onplanes & reference))
+        self.assertTrue(np.any(onplanes & ~reference))
+        self.assertTrue(np.array_equal(body.atoms_in_shape(atoms), reference))
+        # Subsets of different sizes and orders
+        permutation = np.random.default_rng(0).permutation(len(atoms))
+        for size in ( 1, 7, 64, len(atoms) ):
+            subset = permutation[:size]
+            self.assertTrue(np.array_equal(body.atoms_in_shape(atoms[subset]),
+                                           reference[subset]))
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(HalfspaceIntersectionTestCase, 'test'),
+             unittest.makeSuite(LearnedPlaneOrderTestCase, 'test') ]
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))